@@ -1,5 +1,9 @@
+from bisect import bisect_left
 from collections import deque
+from heapq import heappush, heappop
 import numpy as np
+from parallel_helpers import bounded_map, chunked
+from diagram_analytics import top_n
 
 def fm(series):
     """ function fm computes the 0-persistence with output lines
@@ -39,22 +43,367 @@ def fm(series):
     return pers
 
 
-def get_n_farthest(N, output):
-    """Get N points farthest from the diagonal in the PD"""
-    b, _, d, *_ = zip(*output)
-    bmin, dmax = np.nanmin(b), np.nanmax(d)
-    vals = [area_triangle([bmin]*2, [dmax]*2, p) for p in zip(b,d)]
+bar_dtype = np.dtype([('min_value', float), ('min_pos', int),
+                      ('max_value', float), ('max_pos', int),
+                      ('recorded', int)])
+
+
+def turning_points(tser):
+    """ Positions where fm's up/down state flips, and the state before each
+    position (fm starts out going down). """
+    steps = np.sign(np.diff(tser))
+    moving = steps != 0
+    last_move = np.maximum.accumulate(np.where(moving, np.arange(len(steps)),
+                                               -1))
+    last_move = np.concatenate(([-1], last_move[:-1]))
+    state = np.where(last_move >= 0, steps[last_move], -1)
+    return np.flatnonzero(moving & (steps != state)), state
+
+
+def fm_bars(series):
+    """ function fm_bars computes the same 0-persistence bars as fm, as a
+    structured array with fields min_value, min_pos, max_value, max_pos and
+    recorded (see bar_dtype), in the same order.
+
+    fm rescans both stacks at every sample. Here the turning points are
+    found with array operations, the loop only runs over them, and since
+    both stacks stay sorted, the sample at which a stacked extremum gets
+    paired is found by binary search within the current monotone run. The
+    cost is O(n + E log n) for E extrema instead of O(n E). """
+
+    # make the time series well-like, ending with a bang
+    series = np.asarray(series, dtype=float)
+    mx = np.max(series)
+    tser = np.concatenate(([np.inf, mx+10], series, [mx+10, np.inf]))
+    last = len(tser) - 2
+    turns, state = turning_points(tser)
+
+    # Plain lists are much faster than arrays for this element-wise work
+    values, negated, state = tser.tolist(), (-tser).tolist(), state.tolist()
+    pers, stackn, stackx = [], [], []
+    start = 0
+    for end in [*turns.tolist(), last]:
+        up, tp = state[end], values[end]
+        if up > 0:
+            while stackx and stackx[-1][0] <= tp:
+                rec = bisect_left(values, stackx[-1][0], start, end + 1)
+                pers.append((*stackn.pop(), *stackx.pop(), rec))
+        else:
+            while stackn and stackn[-1][0] >= tp:
+                rec = bisect_left(negated, -stackn[-1][0], start, end + 1)
+                pers.append((*stackn.pop(), *stackx.pop(), rec))
+
+        if end != last:
+            # Recall we prepended 2 elements so shift pos by 2
+            (stackx if up > 0 else stackn).append((tp, end - 2))
+        start = end + 1
+
+    # Pair the leftover global minimum with a nan, as fm does
+    pers.append((*stackn.pop(), np.nan, 0, last - 1))
+
+    return np.array(pers, dtype=bar_dtype)
+
+
+batch_bar_dtype = np.dtype(bar_dtype.descr + [('trial', int),
+                                              ('channel', int)])
+
+
+def _fm_chunk(items):
+    """ Bars of a chunk of ((trial, channel), series) items (a pool task). """
+    *parts, = ((fm_bars(series), index) for index, series in items)
+    out = np.empty(sum(len(bars) for bars, _ in parts), dtype=batch_bar_dtype)
+    start = 0
+    for bars, (trial, channel) in parts:
+        rows = out[start:start + len(bars)]
+        for name in bar_dtype.names:
+            rows[name] = bars[name]
+        rows['trial'], rows['channel'] = trial, channel
+        start += len(bars)
+    return out
+
+
+def batch_fm(data, workers=None, chunksize=64, inflight=None):
+    """ function batch_fm computes fm_bars for many series at once and
+    returns them as one structured array (see batch_bar_dtype): the bar
+    fields plus the trial and channel each bar came from, so diagrams can
+    be filtered with array operations.
+
+    Parameters
+    ----------
+    data
+        A (channels x time) or (trials x channels x time) array, or an
+        iterable of 1-D series (numbered as channels of trial 0)
+    workers
+        Number of worker processes; run serially if None
+    chunksize
+        Number of series per pool task
+    inflight
+        Maximum number of chunks in flight (default 2*workers)
+    """
+    if isinstance(data, np.ndarray) and data.ndim == 3:
+        items = (((t, c), series) for t, trial in enumerate(data)
+                 for c, series in enumerate(trial))
+    else:
+        items = (((0, c), series) for c, series in enumerate(data))
+
+    *results, = bounded_map(_fm_chunk, chunked(items, chunksize), workers,
+                            inflight)
+    return np.concatenate(results) if results else np.empty(0, batch_bar_dtype)
+
+
+window_bar_dtype = np.dtype(bar_dtype.descr[:4])
+
+
+def _reach(values, strict, latest):
+    """ For every sample, the nearest earlier sample below it (at or below
+    it unless strict), and the largest value in between with its latest
+    (else earliest) position; -1 and the sample itself where there is
+    none. """
+    reach, barrier, barrier_pos = [], [], []
+    stack = []
+    for pos, value in enumerate(values):
+        bar, bar_pos = value, pos
+        while stack and (stack[-1][1] >= value if strict
+                         else stack[-1][1] > value):
+            _, _, top, top_pos = stack.pop()
+            if top > bar or (top == bar and not latest):
+                bar, bar_pos = top, top_pos
+        reach.append(stack[-1][0] if stack else -1)
+        barrier.append(bar)
+        barrier_pos.append(bar_pos)
+        stack.append((pos, value, bar, bar_pos))
+    return np.array(reach), np.array(barrier), np.array(barrier_pos)
+
+
+class WindowedPersistence:
+    """ 0-persistence of every window of a series, as fm would compute it on
+    the window alone.
+
+    A local minimum of a window dies at the lower of its two barriers: the
+    largest value between it and the nearest sample below it on either
+    side. Both barriers only depend on the series, so they are found once
+    for every sample with monotone stacks; a window just drops the barriers
+    whose nearest lower sample falls outside it (the padding fm adds is
+    higher than anything), and the minimum left with neither barrier is the
+    essential bar. Consecutive windows therefore share all the work: the
+    bars of a window cost a few array operations over its own minima, and
+    `summaries` only updates the bars that change between windows.
+    """
+
+    def __init__(self, series):
+        """ Constructor for the WindowedPersistence class
 
-    # Since bmin, dmax are fixed, area of triangle maximized for
-    # points furthest from the diagonal 
+        Parameters
+        ----------
+        series:
+            A 1-D array without NaNs
+        """
+        self.series = np.asarray(series, dtype=float)
+        values = self.series.tolist()
+        n = len(values)
 
-    ind = np.argpartition(np.asarray(vals), -N)[-N:]
+        # Earlier samples strictly below, later samples at or below, and the
+        # last of equal maxima: this is how fm breaks ties
+        self.left, self.left_bar, self.left_pos = _reach(values, True, True)
+        right, right_bar, right_pos = _reach(values[::-1], False, False)
+        self.right = np.where(right >= 0, n - 1 - right, n)[::-1]
+        self.right_bar, self.right_pos = right_bar[::-1], n - 1 - right_pos[::-1]
 
-    return [output[i] for i in ind]
+        # Nearest samples with a different value before and after each one
+        changes = np.flatnonzero(np.diff(self.series)) + 1
+        self.before = np.concatenate(([-1], changes - 1))[
+            np.searchsorted(changes, np.arange(n), 'right')]
+        self.after = np.concatenate((changes, [n]))[
+            np.searchsorted(changes, np.arange(n), 'right')]
 
+        # Minima of the whole series are minima of every window holding them
+        self.minima = np.flatnonzero(self._is_min(np.arange(n), 0, n))
+
+    def _is_min(self, idx, start, stop):
+        """ Which samples idx are minima of the window start:stop (the last
+        sample of a plateau lower than its neighbours or the window edge). """
+        x = self.series
+        before, after = self.before[idx], self.after[idx]
+        lower_left = (before < start) | (x[np.maximum(before, 0)] > x[idx])
+        lower_right = ((after >= stop)
+                       | (x[np.minimum(after, len(x) - 1)] > x[idx]))
+        last = (idx == stop - 1) | (after == idx + 1)
+        return lower_left & lower_right & last
+
+    def bars(self, start, stop):
+        """ Bars of the window start:stop in order of their minima.
+
+        Parameters
+        ----------
+        start, stop:
+            Bounds of the window in the series
+
+        Returns
+        -------
+        A structured array (see window_bar_dtype) with positions relative
+        to start, like the bars of fm(series[start:stop]); the essential bar
+        has a nan max_value and max_pos 0
+        """
+        lo, hi = np.searchsorted(self.minima, [start, stop])
+        edges = np.array([min(self.after[start], stop) - 1, stop - 1])
+        edges = edges[self._is_min(edges, start, stop)]
+        idx = np.union1d(self.minima[lo:hi], edges)
+
+        left_bar = np.where(self.left[idx] >= start, self.left_bar[idx], np.inf)
+        right_bar = np.where(self.right[idx] < stop, self.right_bar[idx],
+                             np.inf)
+        use_left = left_bar <= right_bar
+
+        out = np.empty(len(idx), dtype=window_bar_dtype)
+        out['min_value'] = self.series[idx]
+        out['min_pos'] = idx - start
+        out['max_value'] = np.where(use_left, left_bar, right_bar)
+        out['max_pos'] = np.where(use_left, self.left_pos[idx],
+                                  self.right_pos[idx]) - start
+        essential = np.isinf(out['max_value'])
+        out['max_value'][essential], out['max_pos'][essential] = np.nan, 0
+        return out
+
+    def windows(self, window, stride=1):
+        """ Yield (start, bars) for every full window of the given length,
+        moving by stride samples. """
+        for start in range(0, len(self.series) - window + 1, stride):
+            yield start, self.bars(start, start + window)
+
+    def summaries(self, window, stride=1, n=5):
+        """ Summary statistics of every window.
+
+        The statistics are updated from one window to the next instead of
+        being rebuilt: a minimum of the series only changes its bar when it
+        enters or leaves the window, when its nearest lower sample on the
+        left leaves it, or when the one on the right enters it. Each of
+        these happens at most once per minimum, so apart from the two
+        window edges the work per window grows with the stride, not with
+        the window length. A heap keeps the n largest persistences.
+
+        Parameters
+        ----------
+        window:
+            Window length
+        stride:
+            Step between window starts
+        n:
+            Number of the most persistent finite bars to keep per window
+
+        Returns
+        -------
+        A structured array with the window start, the number of finite
+        bars, their total persistence and the n largest persistences
+        (descending, nan-padded)
+        """
+        dtype = [('start', int), ('count', int), ('total', float),
+                 ('top', float, (n,))]
+        starts = range(0, len(self.series) - window + 1, stride)
+        out = np.empty(len(starts), dtype=dtype)
+        out['top'] = np.nan
+        if not len(starts):
+            return out
+
+        x, minima = self.series.tolist(), self.minima
+        left, left_bar = self.left.tolist(), self.left_bar.tolist()
+        right, right_bar = self.right.tolist(), self.right_bar.tolist()
+        is_global = np.zeros(len(x), dtype=bool)
+        is_global[minima] = True
+
+        # Minima sorted by their nearest lower samples, to find the ones
+        # whose barrier appears or disappears as the window moves
+        by_left = minima[np.argsort(self.left[minima], kind='stable')]
+        by_right = minima[np.argsort(self.right[minima], kind='stable')]
+        left_keys, right_keys = self.left[by_left], self.right[by_right]
+
+        def life(i, start, stop):
+            bar = min(left_bar[i] if left[i] >= start else np.inf,
+                      right_bar[i] if right[i] < stop else np.inf)
+            return bar - x[i]
+
+        # Persistence of every minimum in the window (inf for the essential
+        # one) and heap entries (-life, i, version); an entry is stale once
+        # the version of i has moved on
+        current, version, heap = {}, [0] * len(x), []
+        state = {'count': 0, 'total': 0.0}
+
+        def add(i, start, stop):
+            value = current[i] = life(i, start, stop)
+            version[i] += 1
+            if value != np.inf:
+                state['count'] += 1
+                state['total'] += value
+                heappush(heap, (-value, i, version[i]))
+
+        def remove(i):
+            value = current.pop(i)
+            version[i] += 1
+            if value != np.inf:
+                state['count'] -= 1
+                state['total'] -= value
+
+        def between(keys, order, lo, hi):
+            return order[np.searchsorted(keys, lo):np.searchsorted(keys, hi)]
+
+        for i in between(minima, minima, 0, window).tolist():
+            add(i, 0, window)
+
+        for row, start in zip(out, starts):
+            stop = start + window
+            if start > 0:
+                before, end = start - stride, stop - stride
+                for i in between(minima, minima, before,
+                                 min(start, end)).tolist():
+                    remove(i)
+                moved = np.concatenate((
+                    between(left_keys, by_left, before, start),
+                    between(right_keys, by_right, end, stop)))
+                for i in moved.tolist():
+                    if i in current:
+                        remove(i)
+                        add(i, start, stop)
+                for i in between(minima, minima, max(end, start),
+                                 stop).tolist():
+                    add(i, start, stop)
+
+            # Minima at the window edges that are not minima of the series
+            edges = np.unique([min(self.after[start], stop) - 1, stop - 1])
+            edges = edges[self._is_min(edges, start, stop)
+                          & ~is_global[edges]]
+            extra = [value for value in (life(i, start, stop)
+                                         for i in edges.tolist())
+                     if value != np.inf]
+
+            best = []
+            while heap and len(best) < n:
+                entry = heappop(heap)
+                if version[entry[1]] == entry[2]:
+                    best.append(entry)
+            for entry in best:
+                heappush(heap, entry)
+            top = sorted([-entry[0] for entry in best] + extra,
+                         reverse=True)[:n]
+
+            row['start'] = start
+            row['count'] = state['count'] + len(extra)
+            row['total'] = state['total'] + sum(extra)
+            row['top'][:len(top)] = top
+        return out
+
+    def __repr__(self):
+        """ Pretty print a WindowedPersistence instance """
+        return "Windowed persistence over {n} samples with {m} minima.".format(
+            n=len(self.series), m=len(self.minima))
+
+
+def get_n_farthest(N, output):
+    """Get N points farthest from the diagonal in the PD"""
+    # Distance from the diagonal is proportional to the persistence, the
+    # never-dying global minimum counts as the farthest
+    return [output[i] for i in top_n(N, output, essential=True)]
 
 
 def area_triangle(a, b, p):
     """Computes the area of the triangle formed by points a, b and p"""
-    (xp, xb, xp), (ya, yb, yp) = zip(a, b, p)
-    return (1/2)* abs((xp - xp)*(yb - ya) - (xp - xb)*(yp - ya))
+    (xa, xb, xp), (ya, yb, yp) = zip(a, b, p)
+    return (1/2)* abs((xb - xa)*(yp - ya) - (xp - xa)*(yb - ya))
@@ -0,0 +1,200 @@
+"""Benchmarks for the cyclicity analysis pipeline.
+
+Times `match_ends`, every entry of `norms`, `create_lead_matrix`,
+`sort_lead_matrix` and `func_helpers.make_lead_matrix` on synthetic
+Ornstein-Uhlenbeck data over a grid of channel counts, series lengths and
+dtypes, and records wall time and peak (traced) memory as JSON so that two
+runs can be compared:
+
+    python benchmarks.py --output before.json
+    python benchmarks.py --output after.json --compare before.json
+"""
+import sys
+import json
+import time
+import argparse
+import platform
+import tracemalloc
+from functools import partial
+
+import numpy as np
+
+import cyclic_analysis as ca
+from stochastic import ou_process, multiplex
+from func_helpers import make_lead_matrix
+
+
+def synthetic_data(N, T, seed=0):
+    """Stack N Ornstein-Uhlenbeck paths of length T into a data matrix."""
+    np.random.seed(seed)
+    model = partial(ou_process, theta=1.0, T=1.0, N=T)
+    return np.asarray(multiplex(N, model))
+
+
+def area_of_pair(pair):
+    """Area integral of a pruned pair, the `intfunc` of make_lead_matrix."""
+    return ca.area_val(*pair)
+
+
+def cases(data, irregular_limit):
+    """Name and zero-argument callable of every benchmarked step."""
+    matched = ca.match_ends(data)
+    lead_matrix = ca.create_lead_matrix(matched)
+    steps = [('match_ends', partial(ca.match_ends, data))]
+    steps += [('norm:{}'.format(key), partial(func, matched))
+              for key, (_, func) in ca.norms.items() if key is not None]
+    steps += [('create_lead_matrix', partial(ca.create_lead_matrix, matched)),
+              ('sort_lead_matrix', partial(ca.sort_lead_matrix, lead_matrix))]
+
+    # make_lead_matrix prunes every pair in Python, keep it to small N
+    if data.shape[0] <= irregular_limit:
+        times = np.arange(data.shape[1], dtype=float)
+        series = [(times, row) for row in matched]
+        steps.append(('make_lead_matrix',
+                      partial(make_lead_matrix, series, area_of_pair)))
+    return steps
+
+
+def measure(func, repeat):
+    """Best wall time over `repeat` runs and the peak memory of one more.
+
+    Memory is traced in a separate run so that tracing does not slow down
+    the timed ones.
+    """
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak
+
+
+def run_benchmarks(channels=(50, 200), lengths=(1000, 10000),
+                   dtypes=('float64', 'float32'), repeat=3,
+                   irregular_limit=32, seed=0):
+    """Run every step over the grid of channels x lengths x dtypes.
+
+    Parameters
+    ----------
+    channels
+        Channel counts N to try
+    lengths
+        Series lengths T to try
+    dtypes
+        Floating dtypes to run in (see `cyclic_analysis.set_default_dtype`)
+    repeat
+        Number of timed runs per step; the fastest is kept
+    irregular_limit
+        Largest N for which make_lead_matrix is timed
+    seed
+        Seed of the synthetic data
+
+    Returns
+    -------
+    A list of records with keys step, N, T, dtype, seconds and peak_bytes
+    """
+    records = list()
+    old_dtype = ca.default_dtype
+    try:
+        for N in channels:
+            for T in lengths:
+                raw = synthetic_data(N, T, seed)
+                for dtype in dtypes:
+                    ca.set_default_dtype(dtype)
+                    data = raw.astype(dtype)
+                    for step, func in cases(data, irregular_limit):
+                        seconds, peak = measure(func, repeat)
+                        records.append({'step': step, 'N': N, 'T': T,
+                                        'dtype': dtype, 'seconds': seconds,
+                                        'peak_bytes': peak})
+    finally:
+        ca.set_default_dtype(old_dtype)
+
+    return records
+
+
+def write_results(records, filename):
+    """Write the records and a description of the machine as JSON."""
+    results = {'python': platform.python_version(),
+               'numpy': np.__version__,
+               'machine': platform.platform(),
+               'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+               'records': records}
+    with open(filename, 'w') as f:
+        json.dump(results, f, indent=1)
+
+
+def load_results(results):
+    """Read results written by `write_results` unless already loaded."""
+    if isinstance(results, dict):
+        return results
+    with open(results) as f:
+        return json.load(f)
+
+
+def compare_results(baseline, current, tolerance=0.2):
+    """Find steps that got slower or hungrier than in a baseline run.
+
+    Parameters
+    ----------
+    baseline, current
+        Results as written by `write_results` (dicts or file names)
+    tolerance
+        Allowed relative increase of time or peak memory
+
+    Returns
+    -------
+    A list of (step, N, T, dtype, metric, old, new) tuples
+    """
+    baseline, current = map(load_results, (baseline, current))
+    key = lambda r: (r['step'], r['N'], r['T'], r['dtype'])
+    old = {key(r): r for r in baseline['records']}
+
+    regressions = list()
+    for record in current['records']:
+        if key(record) not in old:
+            continue
+        for metric in ('seconds', 'peak_bytes'):
+            before, after = old[key(record)][metric], record[metric]
+            if after > before * (1 + tolerance):
+                regressions.append((*key(record), metric, before, after))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--channels', type=int, nargs='+', default=[50, 200])
+    parser.add_argument('--lengths', type=int, nargs='+',
+                        default=[1000, 10000])
+    parser.add_argument('--dtypes', nargs='+',
+                        default=['float64', 'float32'])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', default='benchmarks.json')
+    parser.add_argument('--compare', help='baseline results to compare to')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    records = run_benchmarks(args.channels, args.lengths, args.dtypes,
+                             args.repeat)
+    write_results(records, args.output)
+    for r in records:
+        print("{step:>20} N={N:<6} T={T:<8} {dtype:<8} {seconds:10.5f}s "
+              "{peak_bytes:>12d}B".format(**r))
+
+    if args.compare:
+        regressions = compare_results(args.compare, args.output,
+                                      args.tolerance)
+        for regression in regressions:
+            print("REGRESSION {} N={} T={} {} {}: {} -> {}".format(
+                *regression))
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
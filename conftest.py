@@ -0,0 +1 @@
+# Lets pytest import the flat modules of this repository from tests/
@@ -1,18 +1,65 @@
+import os
+import time
+import hashlib
+import zipfile
 import numpy as np
 from numpy import mod, outer, mean, argsort, std
 from numpy import pi, linspace, newaxis, roll, zeros, angle
-from numpy.linalg import norm, eig
+from numpy.linalg import norm, eig, eigh
 from scipy.signal import detrend
+from parallel_helpers import bounded_map, chunked
 
+default_dtype = np.float64
 
-def match_ends(Z):
+
+def set_default_dtype(dtype):
+    """ Set the floating point type used when no per-call dtype is given.
+
+    Every function in this module that takes a `dtype` argument casts its
+    input with `as_float` first and then keeps that type throughout, so
+    float32 halves the memory and roughly doubles the matrix product
+    throughput of the whole pipeline.
+
+    float32 carries about 7 significant digits. Lead matrix entries are sums
+    of T products, so their relative error grows like sqrt(T) * 6e-8 for
+    typical data (up to T * 6e-8 in the worst case); for T in the millions
+    prefer float64 or the float64 `LeadMatrixAccumulator`. Eigenvalues keep
+    a similar relative accuracy, but the phases, and hence the permutation
+    from `sort_lead_matrix`, can differ from float64 for channels whose
+    phases are closer than that error, or when the leading eigenvalue pair
+    is nearly degenerate with the next one.
+
+    Parameters
+    ----------
+    dtype
+        A numpy floating dtype, or 'preserve' to keep the dtype of floating
+        point inputs (integer inputs still become float64). The initial
+        default is float64, i.e. everything is upcast as before.
+    """
+    global default_dtype
+    default_dtype = dtype
+
+
+def as_float(Z, dtype=None):
+    """ Cast Z to the requested (or default) floating dtype without copying
+    when it already has it. """
+    dtype = default_dtype if dtype is None else dtype
+    Z = np.asarray(Z)
+    if isinstance(dtype, str) and dtype == 'preserve':
+        dtype = Z.dtype if Z.dtype.kind == 'f' else np.float64
+    return Z.astype(dtype, copy=False)
+
+
+def match_ends(Z, dtype=None):
     """ Adjust data so starting and ending points match in the timeseries. """
+    Z = as_float(Z, dtype)
     n = Z.shape[1]  # No of columns
-    return Z - outer(Z[:, n - 1] - Z[:, 0], linspace(0, 1, n))
+    return Z - outer(Z[:, n - 1] - Z[:, 0], linspace(0, 1, n, dtype=Z.dtype))
 
 
-def mean_center(Z):
+def mean_center(Z, dtype=None):
     """ Mean center the data matrix Z. """
+    Z = as_float(Z, dtype)
     return Z - mean(Z, axis=1)[:, newaxis]
 
 
@@ -22,29 +69,183 @@ def total_variation(Z, axis=0):
     return norm(dZ, axis=axis).squeeze()
 
 
-def quad_norm(Z):
+def quad_norm(Z, dtype=None):
     """Normalize vector(s) Z so that the quadratic sum equals to 1."""
+    Z = as_float(Z, dtype)
     norms = norm(Z, axis=1)[:, newaxis]
     normed_z = np.divide(Z, norms, out=np.zeros_like(Z), where=norms!=0)
     return normed_z
 
 
-def tv_norm(Z):
+def tv_norm(Z, dtype=None):
     """ Normalize vector(s) Z so that the quadratic variation is 1. """
+    Z = as_float(Z, dtype)
     norms = total_variation(Z, axis=1)[:, newaxis]
     normed_z = np.divide(Z, norms, out=np.zeros_like(Z), where=norms!=0)
     return normed_z
 
 
-def std_norm(Z):
+def std_norm(Z, dtype=None):
     """ Normalize vector(s) Z so that standard deviation is 1. """
+    Z = as_float(Z, dtype)
     norms = std(Z, axis=1)[:, newaxis]
     normed_z = np.divide(Z, norms, out=np.zeros_like(Z), where=norms!=0)
     return normed_z
 
-def remove_linear(Z):
+def remove_linear(Z, dtype=None):
     """ Remove linear trends in the data. """
-    return detrend(Z)
+    return detrend(as_float(Z, dtype))
+
+
+class Preprocessor:
+    """ Fused trend removal, end matching and normalization of a data matrix.
+
+    Does the work of `norms[norm](match_ends(trend_removals[trend](Z)))`
+    without the intermediate copies: trend removal and end matching together
+    only subtract a line from each row, so the pipeline reads Z once to find
+    the lines, writes the adjusted rows into the output while measuring their
+    norms, and rescales the output in place. Columns are processed `chunk` at
+    a time, so Z and the output may be `np.memmap` arrays larger than memory.
+
+    Parameters
+    ----------
+    trend:
+        A key of `trend_removals`
+    norm:
+        A key of `norms`
+    match:
+        Whether to apply `match_ends` after the trend removal
+    chunk:
+        Number of columns per chunk; all of them at once if None. Besides
+        the output, memory use is a few (N x chunk) float64 temporaries.
+    dtype:
+        Floating dtype of the output; see `set_default_dtype`
+    """
+
+    def __init__(self, trend=None, norm=None, match=True, chunk=4096,
+                 dtype=None):
+        """ Constructor for the Preprocessor class
+
+        Parameters
+        ----------
+        trend:
+            A key of `trend_removals`
+        norm:
+            A key of `norms`
+        match:
+            Whether to apply `match_ends` after the trend removal
+        chunk:
+            Number of columns per chunk (default 4096); all of them at once
+            if None
+        dtype:
+            Floating dtype of the output; see `set_default_dtype`
+        """
+        if trend not in trend_removals:
+            raise ValueError("Unknown trend removal: {}".format(trend))
+        if norm not in norms:
+            raise ValueError("Unknown normalization: {}".format(norm))
+
+        self.trend, self.norm, self.match, self.chunk = trend, norm, match, chunk
+        self.dtype = dtype
+
+    def slices(self, n):
+        """ Column slices covering n columns in chunks. """
+        size = self.chunk or max(n, 1)
+        return [slice(start, min(start + size, n))
+                for start in range(0, n, size)]
+
+    def lines(self, Z):
+        """ Offsets and slopes of the lines to subtract from each row of Z. """
+        N, n = Z.shape
+        origin = np.array(Z[:, 0], dtype=float)
+        offset, slope = zeros(N), zeros(N)
+
+        if self.trend == 'linear':
+            # Least squares line through (t, Z[:, t] - origin)
+            sum_z, sum_tz = zeros(N), zeros(N)
+            for cols in self.slices(n):
+                t = np.arange(cols.start, cols.stop)
+                shifted = Z[:, cols] - origin[:, newaxis]
+                sum_z += shifted.sum(axis=1)
+                sum_tz += shifted.dot(t)
+            sum_t, sum_tt = n * (n - 1) / 2, (n - 1) * n * (2 * n - 1) / 6
+            denom = n * sum_tt - sum_t**2
+            if denom > 0:
+                slope = (n * sum_tz - sum_t * sum_z) / denom
+            offset = origin + (sum_z - slope * sum_t) / n
+
+        if self.match and n > 1:
+            # Whatever line was removed, matching the ends leaves a slope of
+            # (last - first)/(n - 1) and keeps the offset.
+            slope = (Z[:, n - 1] - origin) / (n - 1)
+
+        return offset, slope
+
+    def scales(self, sums, squares, variation, first, last, n):
+        """ Row norms from the moments of the line-adjusted rows. """
+        if self.norm == 'sqr':
+            return np.sqrt(squares)
+        if self.norm == 'std':
+            return np.sqrt(np.maximum(squares / n - (sums / n)**2, 0))
+        if self.norm == 'tv':
+            return np.sqrt(variation + (first - last)**2)
+        return None
+
+    def __call__(self, Z, out=None, inplace=False):
+        """ Preprocess Z into out (a new array, or Z itself if inplace).
+
+        Parameters
+        ----------
+        Z:
+            A (channels x time) array or `np.memmap`
+        out:
+            An optional caller provided floating point array (or memmap) of
+            Z's shape
+        inplace:
+            Overwrite Z, which must then be floating point, with the result
+        """
+        N, n = Z.shape
+        if inplace:
+            out = Z
+        elif out is None:
+            dtype = as_float(np.empty(0, dtype=Z.dtype), self.dtype).dtype
+            out = np.empty((N, n), dtype=dtype)
+        if not np.issubdtype(out.dtype, np.floating):
+            # Writing into an integer array would silently truncate
+            raise ValueError("Cannot write the preprocessed data into a {} "
+                             "array; use a floating point {}".format(
+                                 out.dtype, 'Z' if inplace else 'out'))
+
+        offset, slope = self.lines(Z)
+        sums, squares, variation = zeros(N), zeros(N), zeros(N)
+        first, previous = None, None
+        for cols in self.slices(n):
+            # The lines are evaluated in float64 and the adjusted rows are
+            # written straight into the output
+            t = np.arange(cols.start, cols.stop)
+            line = outer(slope, t)
+            line += offset[:, newaxis]
+            block = out[:, cols]
+            np.subtract(Z[:, cols], line, out=block, casting='same_kind')
+            if self.norm is not None:
+                sums += block.sum(axis=1)
+                squares += np.einsum('ij,ij->i', block, block)
+                steps = np.diff(block, axis=1)
+                variation += np.einsum('ij,ij->i', steps, steps)
+                if previous is None:
+                    first = block[:, 0].copy()
+                else:
+                    variation += (block[:, 0] - previous)**2
+                previous = block[:, -1].copy()
+
+        scale = self.scales(sums, squares, variation, first, previous, n)
+        if scale is not None:
+            inverse = np.divide(1, scale, out=zeros(N), where=scale != 0)
+            inverse = inverse.astype(out.dtype)[:, newaxis]
+            for cols in self.slices(n):
+                out[:, cols] *= inverse
+
+        return out
 
 
 def cyc_diff(x):
@@ -52,10 +253,15 @@ def cyc_diff(x):
     return np.diff(np.concatenate(([x[-1]], x)))
 
 
-def create_lead_matrix(data):
-    """ Create the lead matrix from the data. """
+def cyc_diff_matrix(Z):
+    """ Do cyclic differentiation along the rows of the data matrix Z. """
+    return Z - roll(Z, 1, axis=1)
+
+
+def loop_lead_matrix(data):
+    """ Create the lead matrix from the data one pair at a time. """
     N, time_steps = data.shape
-    lead_matrix = zeros((N, N))
+    lead_matrix = zeros((N, N), dtype=data.dtype)
 
     # Create index list of upper_triangle (lower part is anti-symmetric)
     # This is good for small values of N.
@@ -71,12 +277,363 @@ def create_lead_matrix(data):
     return lead_matrix
 
 
+def gemm_lead_matrix(data):
+    """ Create the lead matrix from the data with a single matrix product.
+
+    Entry (i, j) of the lead matrix is x_i . dx_j - x_j . dx_i where dx is
+    the cyclic difference, so the whole matrix is A - A.T with A = X dX^T.
+    """
+    A = data.dot(cyc_diff_matrix(data).T)
+    return A - A.T
+
+
+def create_lead_matrix(data, engine='gemm', dtype=None):
+    """ Create the lead matrix from the data.
+
+    Parameters
+    ----------
+    data
+        The (channels x time) data matrix
+    engine
+        One of the keys of `lead_engines`; 'gemm' (default) or 'loop'
+    dtype
+        Floating dtype to compute in; see `set_default_dtype`
+    """
+    return lead_engines[engine][1](as_float(data, dtype))
+
+
+def lagged_products(Z):
+    """ Sum of the outer products of consecutive columns of Z. """
+    return Z[:, :-1].dot(Z[:, 1:].T)
+
+
+def matched_lead_matrix(lagged, total, first, last, n):
+    """ Lead matrix of match_ends(data) from running moments of the data.
+
+    Parameters
+    ----------
+    lagged
+        Sum over t of outer(data[:, t-1], data[:, t])
+    total
+        Row sums of data
+    first, last
+        First and last columns of data
+    n
+        Number of time steps in data
+    """
+    # match_ends subtracts c * t/(n-1) from each row; only the
+    # antisymmetric part of the correction survives in the lead matrix.
+    ends = last - first
+    weights = first + n * last - 2 * total
+    correction = outer(ends, weights) / (n - 1)
+    return (lagged - lagged.T) - (correction - correction.T)
+
+
+class LeadMatrixAccumulator:
+    """ Accumulate the lead matrix of a long recording one time-chunk at a time.
+
+    Feeding every column of `data` through `update` and calling `finalize`
+    gives `create_lead_matrix(match_ends(data))` without ever holding more
+    than one chunk in memory. Only the lag-one products, the running row sum
+    and the first/last columns are kept, so memory is O(N^2 + N * chunk).
+
+    Parameters
+    ----------
+    N
+        Number of channels (rows) in each chunk
+    dtype
+        Floating dtype of the running sums; see `set_default_dtype`
+    """
+
+    def __init__(self, N, dtype=None):
+        """ Constructor for the LeadMatrixAccumulator class
+
+        Parameters
+        ----------
+        N:
+            Number of channels (rows) in each chunk
+        dtype:
+            Floating dtype of the running sums; see `set_default_dtype`
+        """
+        self.N = N
+        self.n = 0
+        self.dtype = default_dtype if dtype is None else dtype
+        self.lagged = None
+        self.total = None
+        self.first = None
+        self.last = None
+
+    def update(self, chunk):
+        """ Add a (channels x time) chunk that follows the previous ones. """
+        chunk = as_float(chunk, self.dtype)
+        if chunk.shape[1] == 0:
+            return self
+
+        if self.last is None:
+            # Allocated here so that a 'preserve' dtype follows the data
+            self.dtype = chunk.dtype
+            self.lagged = zeros((self.N, self.N), dtype=chunk.dtype)
+            self.total = zeros(self.N, dtype=chunk.dtype)
+            self.first = chunk[:, 0].copy()
+        else:
+            self.lagged += outer(self.last, chunk[:, 0])
+
+        self.lagged += lagged_products(chunk)
+        self.total += chunk.sum(axis=1)
+        self.last = chunk[:, -1].copy()
+        self.n += chunk.shape[1]
+        return self
+
+    def finalize(self):
+        """ Return the lead matrix of everything seen so far. """
+        if self.n < 2:
+            return zeros((self.N, self.N), dtype=as_float([], self.dtype).dtype)
+        return matched_lead_matrix(self.lagged, self.total, self.first,
+                                   self.last, self.n)
+
+
+def iter_chunks(Z, size):
+    """ Yield column chunks of width `size` from a (possibly memmapped) Z. """
+    for start in range(0, Z.shape[1], size):
+        yield Z[:, start:start + size]
+
+
+def streamed_lead_matrix(chunks, N=None, dtype=None):
+    """ Create the lead matrix of match_ends(data) from an iterable of chunks.
+
+    Parameters
+    ----------
+    chunks
+        An iterable of (channels x time) arrays in time order, for example
+        `iter_chunks(np.load(path, mmap_mode='r'), 4096)`
+    N
+        Number of channels; taken from the first chunk if not given
+    dtype
+        Floating dtype of the running sums; see `set_default_dtype`
+    """
+    accumulator = None if N is None else LeadMatrixAccumulator(N, dtype)
+    for chunk in chunks:
+        if accumulator is None:
+            accumulator = LeadMatrixAccumulator(chunk.shape[0], dtype)
+        accumulator.update(chunk)
+
+    if accumulator is None:
+        raise ValueError("No chunks to accumulate and N was not given")
+    return accumulator.finalize()
+
+
+def iter_rolling_lead_matrices(data, window, stride=1, refresh=None,
+                               dtype=None):
+    """ Yield create_lead_matrix(match_ends(w)) for sliding windows w of data.
+
+    Consecutive windows share all but `stride` columns, so each step only
+    adds the lag-one products entering the window and subtracts the ones
+    leaving it: O(N^2 * stride) per step instead of O(N^2 * window).
+
+    Parameters
+    ----------
+    data
+        The (channels x time) data matrix
+    window
+        Number of time steps in each window (at least 2)
+    stride
+        Number of time steps between the starts of consecutive windows
+    refresh
+        Recompute the running sums from scratch every `refresh` windows to
+        stop rounding errors from piling up. Never, if None.
+    dtype
+        Floating dtype to compute in; see `set_default_dtype`
+    """
+    data = as_float(data, dtype)
+    N, time_steps = data.shape
+    if window < 2:
+        raise ValueError("window must be at least 2 time steps")
+
+    lagged, total = None, None
+    for k, start in enumerate(range(0, time_steps - window + 1, stride)):
+        stop = start + window
+        if lagged is None or stride >= window or (refresh and k % refresh == 0):
+            lagged = lagged_products(data[:, start:stop])
+            total = data[:, start:stop].sum(axis=1)
+        else:
+            old, new = start - stride, stop - stride
+            lagged += lagged_products(data[:, new - 1:stop])
+            lagged -= lagged_products(data[:, old:start + 1])
+            total += data[:, new:stop].sum(axis=1)
+            total -= data[:, old:start].sum(axis=1)
+
+        yield matched_lead_matrix(lagged, total, data[:, start],
+                                  data[:, stop - 1], window)
+
+
+def rolling_lead_matrices(data, window, stride=1, p=None, refresh=None,
+                          dtype=None):
+    """ Stack the lead matrices of sliding windows over the data.
+
+    Parameters
+    ----------
+    data
+        The (channels x time) data matrix
+    window
+        Number of time steps in each window
+    stride
+        Number of time steps between the starts of consecutive windows
+    p
+        If given, also return the `sort_lead_matrix(LM, p)` output for
+        every window
+    refresh, dtype
+        See `iter_rolling_lead_matrices`
+
+    Returns
+    -------
+    An array of shape (windows, N, N), and a list of `sort_lead_matrix`
+    tuples if p is given.
+    """
+    *lead_matrices, = iter_rolling_lead_matrices(data, window, stride, refresh,
+                                                 dtype)
+    lead_matrices = np.asarray(lead_matrices)
+    if p is None:
+        return lead_matrices
+
+    return lead_matrices, [sort_lead_matrix(LM, p, dtype=dtype)
+                           for LM in lead_matrices]
+
+
+def _share_tile_source(data, dtype):
+    """ Map setup: open (or keep) the data matrix in every worker. """
+    if isinstance(data, (str, os.PathLike)):
+        data = np.load(data, mmap_mode='r')
+    return data, dtype
+
+
+def _lead_tile(bounds, source):
+    """ Compute the (I, J) tile of the lead matrix (a pool task). """
+    i0, i1, j0, j1 = bounds
+    data, dtype = source
+    rows = as_float(data[i0:i1], dtype)
+    cols = rows if (i0, i1) == (j0, j1) else as_float(data[j0:j1], dtype)
+    tile = rows.dot(cyc_diff_matrix(cols).T) - cyc_diff_matrix(rows).dot(cols.T)
+    return i0, j0, tile
+
+
+def tiled_lead_matrix(data, out=None, block=1024, workers=None, inflight=None,
+                      dtype=None):
+    """ Create the lead matrix in (block x block) tiles.
+
+    Only the tiles on and above the diagonal are computed; each one is also
+    written, negated and transposed, below the diagonal. A tile needs two
+    row blocks of the data, so memory stays at O(block * T + block^2) per
+    worker however many channels there are, and the output can live on disk.
+
+    Parameters
+    ----------
+    data
+        The (channels x time) data matrix, already passed through
+        `match_ends`, or the path of a `.npy` file holding it; workers then
+        memory map the file instead of receiving a copy of the data
+    out
+        Where to write the N x N result: an array, an `np.memmap`, or the
+        path of a `.npy` file to create. A new in-memory array if None.
+    block
+        Number of channels per tile side
+    workers
+        Number of worker processes; run serially if None
+    inflight
+        Maximum number of tiles in flight (default 2*workers)
+    dtype
+        Floating dtype to compute in; see `set_default_dtype`
+    """
+    source = data
+    if isinstance(data, (str, os.PathLike)):
+        data = np.load(data, mmap_mode='r')
+    N = data.shape[0]
+
+    dtype = as_float(np.empty(0, dtype=data.dtype), dtype).dtype
+    if out is None:
+        out = np.empty((N, N), dtype=dtype)
+    elif isinstance(out, (str, os.PathLike)):
+        out = np.lib.format.open_memmap(out, mode='w+', dtype=dtype,
+                                        shape=(N, N))
+
+    starts = range(0, N, block)
+    tiles = ((i, min(i + block, N), j, min(j + block, N))
+             for i in starts for j in starts if j >= i)
+
+    for i0, j0, tile in bounded_map(_lead_tile, tiles, workers, inflight,
+                                    ordered=False,
+                                    setup=_share_tile_source,
+                                    setup_args=(source, dtype)):
+        i1, j1 = i0 + tile.shape[0], j0 + tile.shape[1]
+        out[i0:i1, j0:j1] = tile
+        out[j0:j1, i0:i1] = -tile.T
+
+    if isinstance(out, np.memmap):
+        out.flush()
+    return out
+
+
 def area_val(x, y):
     """ Return the area integral between two arrays x and y. """
     return x.dot(cyc_diff(y)) - y.dot(cyc_diff(x)) 
 
 
-def sort_lead_matrix(LM, p=1):
+def paired_order(mu):
+    """ Order eigenvalues mu of 1j*LM into the conjugate pairs of LM.
+
+    LM has eigenvalues -1j*mu. Pairs are ordered by decreasing magnitude
+    with the +i|mu| member first, matching the layout that `eig` returns
+    and that `sort_lead_matrix` relies on when it picks column 2*p-2.
+    """
+    neg = np.flatnonzero(mu < 0)
+    neg = neg[argsort(mu[neg], kind='stable')]
+    pos = np.flatnonzero(mu >= 0)
+    pos = pos[argsort(-mu[pos], kind='stable')]
+
+    n = min(neg.size, pos.size)
+    order = np.empty(2 * n, dtype=int)
+    order[0::2], order[1::2] = neg[:n], pos[:n]
+    return np.concatenate((order, neg[n:], pos[n:]))
+
+
+def lead_eigs(LM, solver='eig', k=None):
+    """ Eigenvalues and eigenvectors of the lead matrix.
+
+    Parameters
+    ----------
+    LM
+        The Lead matrix
+    solver
+        'eig' uses dense general `numpy.linalg.eig` (the original behaviour).
+        'eigh' uses the fact that 1j*LM is Hermitian: the eigenvalues come
+        out real and are ordered into conjugate pairs of decreasing
+        magnitude. 'arpack' only computes the k leading eigenpairs of
+        1j*LM with the Lanczos solver `scipy.sparse.linalg.eigsh`.
+    k
+        Number of leading eigenpairs to keep; all of them if None ('eig',
+        'eigh'). With k, 'eig' output is first ordered into conjugate pairs
+        of decreasing magnitude like the other solvers.
+    """
+    if solver == 'eig':
+        evals, evecs = eig(LM)
+        if k is None:
+            return evals, evecs
+        order = paired_order((1j * evals).real)[:k]
+        return evals[order], evecs[:, order]
+
+    N = LM.shape[0]
+    if solver == 'arpack' and k is not None and k < N - 1:
+        from scipy.sparse.linalg import eigsh
+        mu, evecs = eigsh(1j * LM, k=k, which='LM')
+    elif solver in ('eigh', 'arpack'):
+        mu, evecs = eigh(1j * LM)
+    else:
+        raise ValueError("Unknown eigensolver: {}".format(solver))
+
+    order = paired_order(mu)[:k]
+    return -1j * mu[order], evecs[:, order]
+
+
+def sort_lead_matrix(LM, p=1, solver='eig', k=None, dtype=None):
     """" Sort the lead matrix using the phases of the p-th eigenvector.
 
     Parameters
@@ -85,10 +642,24 @@ def sort_lead_matrix(LM, p=1):
         The Lead matrix
     p
         The eigenvector index to use (integer: 0, 1, ...)
+    solver
+        One of 'eig', 'eigh' or 'arpack'; see `lead_eigs`
+    k
+        Number of leading eigenvalues to return. Defaults to all of them,
+        or to 2*p for 'arpack' since only the p-th pair is needed.
+    dtype
+        Floating dtype to compute in; see `set_default_dtype`. A float32
+        lead matrix gives complex64 eigenvalues and eigenvectors.
     """
     # The first input should be the matrix to be sorted, the second is the
     # phase or eigenvector to use (default 1).
-    evals, phases = eig(LM)
+    LM = as_float(LM, dtype)
+    if solver == 'arpack' and k is None:
+        k = 2 * p
+    if k is not None and k < 2 * p - 1:
+        raise ValueError("k={} eigenpairs do not include the p={} "
+                         "eigenvector; need k >= {}".format(k, p, 2 * p - 1))
+    evals, phases = lead_eigs(LM, solver, k)
     phases = phases[:, 2 * p - 2]
     sorted_ang = np.sort(mod(angle(phases), 2 * pi))
     dang = np.diff(np.hstack((sorted_ang, sorted_ang[0] + 2 * pi)))
@@ -101,7 +672,7 @@ def sort_lead_matrix(LM, p=1):
 
     return LM, phases, perm, sortedLM, evals
 
-def cyclic_analysis(data, p):
+def cyclic_analysis(data, p, solver='eig', k=None, dtype=None):
     """ Wrapper function to perform cyclicity analysis. 
 
     Parameters
@@ -110,9 +681,358 @@ def cyclic_analysis(data, p):
         Appropriately normalized data matrix 
     p
         Eigenvector index/cycle to consider
+    solver, k
+        Eigensolver options passed on to `sort_lead_matrix`
+    dtype
+        Floating dtype to compute in; see `set_default_dtype`
     """
-    lead_matrix = create_lead_matrix(match_ends(data))
-    return sort_lead_matrix(lead_matrix, p) 
+    lead_matrix = create_lead_matrix(match_ends(data, dtype), dtype=dtype)
+    return sort_lead_matrix(lead_matrix, p, solver, k, dtype)
+
+
+def stacked_lead_matrices(Z):
+    """ Lead matrices of match_ends(Z[b]) for a (batch x N x T) stack Z. """
+    n = Z.shape[-1]
+    ramp = linspace(0, 1, n, dtype=Z.dtype)
+    Z = Z - (Z[..., -1] - Z[..., 0])[..., newaxis] * ramp
+    A = np.matmul(Z, (Z - roll(Z, 1, axis=-1)).swapaxes(-1, -2))
+    return A - A.swapaxes(-1, -2)
+
+
+def _analyse_batch(args):
+    """ Preprocess and analyse one batch of trials (a pool task). """
+    batch, p, norm, trend, solver, k, dtype = args
+    prepare = Preprocessor(trend, norm, match=False, dtype=dtype)
+    *batch, = (prepare(np.asarray(Z)) for Z in batch)
+
+    if len({Z.shape for Z in batch}) == 1:
+        lead_matrices = stacked_lead_matrices(np.stack(batch))
+    else:
+        lead_matrices = [create_lead_matrix(match_ends(Z, dtype), dtype=dtype)
+                         for Z in batch]
+
+    return [sort_lead_matrix(LM, p, solver, k, dtype) for LM in lead_matrices]
+
+
+def iter_batch_cyclic_analysis(trials, p, norm=None, trend=None,
+                               batch_size=16, workers=None, inflight=None,
+                               solver='eig', k=None, dtype=None):
+    """ Lazily run cyclicity analysis over many trials; see
+    `batch_cyclic_analysis`. Yields one `sort_lead_matrix` tuple per trial,
+    in input order. """
+    # Workers do not see set_default_dtype, so resolve the dtype here
+    dtype = default_dtype if dtype is None else dtype
+    tasks = ((batch, p, norm, trend, solver, k, dtype)
+             for batch in chunked(trials, batch_size))
+    for results in bounded_map(_analyse_batch, tasks, workers, inflight):
+        yield from results
+
+
+def batch_cyclic_analysis(trials, p, norm=None, trend=None, batch_size=16,
+                          workers=None, inflight=None, solver='eig', k=None,
+                          dtype=None):
+    """ Run cyclicity analysis over many trials or subjects.
+
+    Each trial is detrended and normalized with the `trend_removals` and
+    `norms` entries named by `trend` and `norm`, then passed through
+    `cyclic_analysis`. Trials are grouped into batches; the lead matrices of
+    a batch whose trials share a shape are computed as one stacked matrix
+    product, and batches are spread over a process pool. At most `inflight`
+    batches are held in memory at a time.
+
+    Parameters
+    ----------
+    trials
+        A (trials x channels x time) array or an iterable of
+        (channels x time) matrices, possibly of different shapes
+    p
+        Eigenvector index/cycle to consider
+    norm, trend
+        Keys of the `norms` and `trend_removals` tables
+    batch_size
+        Number of trials per pool task
+    workers
+        Number of worker processes; run serially if None
+    inflight
+        Maximum number of batches submitted at once (default 2*workers)
+    solver, k
+        Eigensolver options passed on to `sort_lead_matrix`
+    dtype
+        Floating dtype to compute in; see `set_default_dtype`
+
+    Returns
+    -------
+    A list of `sort_lead_matrix` tuples in the order of the input trials
+    """
+    return list(iter_batch_cyclic_analysis(trials, p, norm, trend, batch_size,
+                                           workers, inflight, solver, k,
+                                           dtype))
+
+
+def _share_surrogate_source(data):
+    """ Map setup: keep the data and its spectrum in every worker. """
+    return data, np.fft.rfft(data, axis=1)
+
+
+def phase_surrogates(spectrum, n, size, rng):
+    """ Phase randomized surrogates from the rfft spectrum of the data.
+
+    Every channel of every surrogate gets its own uniformly random phases,
+    which keeps the power spectra but destroys any lead/lag relations. The
+    DC (and Nyquist) terms are left alone so the surrogates stay real.
+    """
+    phases = rng.uniform(0, 2 * pi, (size,) + spectrum.shape)
+    phases = phases.astype(spectrum.real.dtype)
+    phases[..., 0] = 0
+    if n % 2 == 0:
+        phases[..., -1] = 0
+    return np.fft.irfft(spectrum * np.exp(1j * phases), n=n, axis=-1)
+
+
+def shift_surrogates(data, size, rng):
+    """ Surrogates made by cyclically shifting every channel at random. """
+    N, n = data.shape
+    shifts = rng.integers(0, n, (size, N))
+    index = (np.arange(n) - shifts[..., newaxis]) % n
+    return np.take_along_axis(data[newaxis], index, axis=-1)
+
+
+surrogate_methods = {'phase': 'Phase Randomization',
+                     'shift': 'Random Cyclic Shifts'}
+
+
+def _surrogate_batch(args, source):
+    """ Exceedance counts and moments of one batch of surrogates. """
+    observed, method, size, seed = args
+    rng = np.random.default_rng(seed)
+    data, spectrum = source
+    if method == 'phase':
+        batch = phase_surrogates(spectrum,
+                                 data.shape[1], size, rng)
+    elif method == 'shift':
+        batch = shift_surrogates(data, size, rng)
+    else:
+        raise ValueError("Unknown surrogate method: {}".format(method))
+
+    lead_matrices = stacked_lead_matrices(batch)
+    exceed = (np.abs(lead_matrices) >= np.abs(observed)).sum(axis=0)
+    # The moments are small (N x N), so keep them in float64 regardless
+    return (exceed, lead_matrices.sum(axis=0, dtype=float),
+            (lead_matrices**2).sum(axis=0, dtype=float))
+
+
+def surrogate_test(data, n_surrogates=200, method='phase', batch_size=16,
+                   workers=None, inflight=None, seed=None, dtype=None):
+    """ Test every entry of the lead matrix against surrogate data.
+
+    Surrogates are generated `batch_size` at a time in one vectorized FFT
+    (or index) operation and their lead matrices are computed as a single
+    stacked matrix product. Batches can be spread over a process pool; at
+    most `inflight` batches exist at once, which caps the memory used.
+
+    Parameters
+    ----------
+    data
+        Appropriately normalized data matrix
+    n_surrogates
+        Total number of surrogates M
+    method
+        A key of `surrogate_methods`: 'phase' or 'shift'
+    batch_size
+        Number of surrogates per batch
+    workers
+        Number of worker processes; run serially if None
+    inflight
+        Maximum number of batches in flight (default 2*workers)
+    seed
+        Seed for `np.random.SeedSequence`; results do not depend on workers
+    dtype
+        Floating dtype of the data and surrogates; see `set_default_dtype`
+
+    Returns
+    -------
+    A tuple of (lead matrix, z-scores, two-sided p-values), where the
+    p-value of an entry is (1 + #{|surrogate| >= |observed|}) / (M + 1).
+    """
+    data = as_float(data, dtype)
+    observed = create_lead_matrix(match_ends(data, dtype), dtype=dtype)
+
+    sizes = [min(batch_size, n_surrogates - start)
+             for start in range(0, n_surrogates, batch_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    tasks = ((observed, method, size, seed) for size, seed in zip(sizes, seeds))
+
+    exceed, total, squares = 0, 0, 0
+    for counts, sums, sqr_sums in bounded_map(
+            _surrogate_batch, tasks, workers, inflight, ordered=False,
+            setup=_share_surrogate_source, setup_args=(data,)):
+        exceed, total, squares = exceed + counts, total + sums, squares + sqr_sums
+
+    mean_lm = total / n_surrogates
+    std_lm = np.sqrt(np.maximum(squares / n_surrogates - mean_lm**2, 0))
+    zscores = np.divide(observed - mean_lm, std_lm,
+                        out=np.zeros_like(observed), where=std_lm > 0)
+    pvalues = (1 + exceed) / (n_surrogates + 1)
+
+    return observed, zscores, pvalues
+
+
+class ResultCache:
+    """ An on-disk, content addressed cache of cyclicity analysis results.
+
+    Results are stored as compressed `.npz` files named by a hash of the
+    input array and the analysis parameters. Files are touched when read,
+    and the least recently used ones are deleted whenever the directory
+    grows past `max_bytes`.
+
+    Parameters
+    ----------
+    directory:
+        Where to keep the cached results
+    max_bytes:
+        Size limit of the cache directory
+    """
+
+    fields = ('LM', 'phases', 'perm', 'sortedLM', 'evals')
+
+    def __init__(self, directory, max_bytes=2**30):
+        """ Constructor for the ResultCache class
+
+        Parameters
+        ----------
+        directory:
+            Where to keep the cached results
+        max_bytes:
+            Size limit of the cache directory
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits, self.misses = 0, 0
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, data, **params):
+        """ Hash the bytes, shape and dtype of data together with params. """
+        data = np.ascontiguousarray(data)
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(repr((data.shape, data.dtype.str,
+                            sorted(params.items()))).encode())
+        digest.update(memoryview(data).cast('B'))
+        return digest.hexdigest()
+
+    def path(self, key):
+        """ File name of the entry for key. """
+        return os.path.join(self.directory, key + '.npz')
+
+    def get(self, key):
+        """ Return the cached result tuple for key, or None on a miss. """
+        path = self.path(key)
+        try:
+            with np.load(path) as stored:
+                result = tuple(stored[field] for field in self.fields)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except (OSError, KeyError, ValueError, EOFError, zipfile.BadZipFile):
+            # A corrupt or truncated entry counts as a miss and is dropped
+            self.misses += 1
+            self.remove(path)
+            return None
+
+        os.utime(path)
+        self.hits += 1
+        return result
+
+    def put(self, key, result):
+        """ Store a (LM, phases, perm, sortedLM, evals) tuple under key. """
+        partial = self.path(key) + '.part'
+        with open(partial, 'wb') as f:
+            np.savez_compressed(f, **dict(zip(self.fields, result)))
+        os.replace(partial, self.path(key))
+        self.evict()
+
+    def entries(self, suffix='.npz'):
+        """ (last used, size, path) of every cached result (or of every file
+        with another suffix), oldest first. """
+        paths = (os.path.join(self.directory, name)
+                 for name in os.listdir(self.directory)
+                 if name.endswith(suffix))
+        stats = list()
+        for path in paths:
+            try:
+                stats.append((os.stat(path), path))
+            except FileNotFoundError:
+                pass
+        return sorted((stat.st_mtime, stat.st_size, path)
+                      for stat, path in stats)
+
+    @staticmethod
+    def remove(path):
+        """ Delete a file unless someone else already did. """
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def evict(self, part_age=3600):
+        """ Delete least recently used results until under max_bytes, and
+        partial files of interrupted `put`s older than part_age seconds. """
+        for modified, _, path in self.entries('.npz.part'):
+            if modified < time.time() - part_age:
+                self.remove(path)
+
+        entries = self.entries()
+        size = sum(entry[1] for entry in entries)
+        for _, entry_size, path in entries:
+            if size <= self.max_bytes:
+                break
+            self.remove(path)
+            size -= entry_size
+
+    def clear(self):
+        """ Delete every cached result and partial file. """
+        for suffix in ('.npz', '.npz.part'):
+            for *_, path in self.entries(suffix):
+                self.remove(path)
+
+    def __repr__(self):
+        """ Pretty print a ResultCache instance """
+        return "Result cache at {d} with {h} hits and {m} misses.".format(
+            d=self.directory, h=self.hits, m=self.misses)
+
+
+def cached_cyclic_analysis(data, p, cache=None, trend=None, norm=None,
+                           solver='eig', k=None, dtype=None):
+    """ Preprocess the data and run cyclicity analysis, reusing old results.
+
+    Parameters
+    ----------
+    data
+        The raw (channels x time) data matrix
+    p
+        Eigenvector index/cycle to consider
+    cache
+        A `ResultCache`; results are always recomputed if None
+    trend, norm
+        Keys of the `trend_removals` and `norms` tables
+    solver, k
+        Eigensolver options passed on to `sort_lead_matrix`
+    dtype
+        Floating dtype to compute in; see `set_default_dtype`
+    """
+    data = np.asarray(data)
+    if cache is not None:
+        resolved = as_float(np.empty(0, dtype=data.dtype), dtype).dtype
+        key = cache.key(data, p=p, trend=trend, norm=norm, solver=solver,
+                        k=k, dtype=resolved.str)
+        result = cache.get(key)
+        if result is not None:
+            return result
+
+    prepared = Preprocessor(trend, norm, match=False, dtype=dtype)(data)
+    result = cyclic_analysis(prepared, p, solver, k, dtype)
+    if cache is not None:
+        cache.put(key, result)
+    return result
 
 
 norms = {None: ('Leave Intact', lambda t: t),
@@ -120,5 +1040,8 @@ norms = {None: ('Leave Intact', lambda t: t),
          'tv': ('Unit Quadratic Variation', tv_norm), 
          'std': ('Unit Standard Deviation', std_norm)}
 
+lead_engines = {'loop': ('Pairwise Loop', loop_lead_matrix),
+                'gemm': ('Single Matrix Product', gemm_lead_matrix)}
+
 trend_removals = {None: ('None', lambda t: t),
                   'linear': ('Remove Linear Trend', remove_linear)}
@@ -0,0 +1,182 @@
+"""Analytics on 0-persistence diagrams as produced by `abr_funcs.fm`.
+
+A diagram is accepted in any of the forms the persistence code produces:
+the deque (or list) of fm bars, the structured array of `fm_bars` or
+`batch_fm` (one channel of it), or a (k x 2) array of (birth, death) pairs.
+Bars are born at their minimum value and die at their maximum value, so the
+persistence death - birth of a bar is its (scaled) distance from the
+diagonal. The essential bar of the global minimum (death nan) never dies
+and is left out of the distances below.
+"""
+from functools import partial
+from itertools import combinations
+
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import maximum_bipartite_matching
+
+from parallel_helpers import bounded_map, chunked, share
+
+
+def as_diagram(output, finite=True):
+    """ Birth and death columns of a diagram as a (k x 2) float array.
+
+    Parameters
+    ----------
+    output
+        fm bars, an fm_bars structured array or (birth, death) pairs
+    finite
+        Drop bars whose birth or death is not finite (the essential bar)
+    """
+    if isinstance(output, np.ndarray) and output.dtype.names:
+        diagram = np.column_stack((output['min_value'], output['max_value']))
+    else:
+        diagram = np.array([bar[::2][:2] if len(bar) > 2 else bar
+                            for bar in output], dtype=float).reshape(-1, 2)
+    diagram = diagram.astype(float, copy=False)
+    if finite:
+        diagram = diagram[np.isfinite(diagram).all(axis=1)]
+    return diagram
+
+
+def persistence(output):
+    """ Persistence (death - birth) of every bar, nan for the essential one. """
+    diagram = as_diagram(output, finite=False)
+    return diagram[:, 1] - diagram[:, 0]
+
+
+def top_n(N, output, essential=False):
+    """ Indices of the N bars farthest from the diagonal, most persistent
+    first.
+
+    Parameters
+    ----------
+    N
+        Number of bars wanted (fewer if the diagram has fewer)
+    output
+        A diagram in any form accepted by `as_diagram`
+    essential
+        Rank the essential bar first (as if infinitely persistent) instead
+        of leaving it out
+    """
+    life = persistence(output)
+    life = np.where(np.isnan(life), np.inf if essential else -np.inf, life)
+    candidates = np.flatnonzero(life > -np.inf)
+    N = min(N, len(candidates))
+    if N <= 0:
+        return np.empty(0, dtype=int)
+
+    best = candidates[np.argpartition(-life[candidates], N - 1)[:N]]
+    return best[np.argsort(-life[best], kind='stable')]
+
+
+def matching_costs(A, B, p=None):
+    """ Cost matrix of matching diagram A against diagram B.
+
+    Rows are the points of A followed by the diagonal projections of B,
+    columns the points of B followed by the diagonal projections of A. Point
+    to point costs use the sup norm, a point is matched to the diagonal at
+    half its persistence, a point cannot be matched to another point's
+    projection and projections match each other for free.
+
+    Parameters
+    ----------
+    A, B
+        (m x 2) and (n x 2) arrays of finite (birth, death) pairs
+    p
+        Raise every cost to this power (for Wasserstein distances)
+    """
+    m, n = len(A), len(B)
+    costs = np.full((m + n, n + m), np.inf)
+    costs[:m, :n] = np.abs(A[:, None, :] - B[None, :, :]).max(axis=2)
+    costs[:m, n:][np.diag_indices(m)] = (A[:, 1] - A[:, 0]) / 2
+    costs[m:, :n][np.diag_indices(n)] = (B[:, 1] - B[:, 0]) / 2
+    costs[m:, n:] = 0
+    return costs if p is None else costs ** p
+
+
+def bottleneck_distance(A, B):
+    """ Bottleneck distance between two diagrams.
+
+    The answer is one of the finite matching costs: binary search over
+    them for the smallest one that admits a perfect matching using only
+    cheaper edges, each check being a Hopcroft-Karp maximum matching.
+    """
+    A, B = as_diagram(A), as_diagram(B)
+    if not len(A) and not len(B):
+        return 0.
+    costs = matching_costs(A, B)
+    size = len(costs)
+    candidates = np.unique(costs[np.isfinite(costs)])
+
+    lo, hi = 0, len(candidates) - 1
+    while lo < hi:
+        mid = (lo + hi) // 2
+        graph = csr_matrix(costs <= candidates[mid])
+        matched = maximum_bipartite_matching(graph, perm_type='column')
+        if np.count_nonzero(matched >= 0) == size:
+            hi = mid
+        else:
+            lo = mid + 1
+    return float(candidates[lo])
+
+
+def wasserstein_distance(A, B, p=2):
+    """ p-Wasserstein distance between two diagrams (sup norm ground metric),
+    from an optimal assignment on the augmented cost matrix. """
+    A, B = as_diagram(A), as_diagram(B)
+    if not len(A) and not len(B):
+        return 0.
+    costs = matching_costs(A, B, p)
+    rows, cols = linear_sum_assignment(costs)
+    return float(costs[rows, cols].sum() ** (1 / p))
+
+
+distances = {'bottleneck': ("Bottleneck distance", bottleneck_distance),
+             'wasserstein': ("p-Wasserstein distance", wasserstein_distance)}
+
+
+def _pair_distances(args, shared):
+    """Distances of a chunk of index pairs (a pool task)."""
+    index_pairs, metric, options = args
+    func, diagrams = distances[metric][1], shared['diagrams']
+    return [(i, j, func(diagrams[i], diagrams[j], **options))
+            for i, j in index_pairs]
+
+
+def pairwise_distances(diagrams, metric='bottleneck', workers=None,
+                       chunksize=64, inflight=None, **options):
+    """ Symmetric matrix of distances between every pair of diagrams.
+
+    Parameters
+    ----------
+    diagrams
+        A list of diagrams in any form accepted by `as_diagram`
+    metric
+        A key of `distances`
+    workers
+        Number of worker processes; run serially if None
+    chunksize
+        Number of pairs per pool task
+    inflight
+        Maximum number of chunks in flight (default 2*workers)
+    options
+        Passed on to the distance, e.g. p for 'wasserstein'
+    """
+    if metric not in distances:
+        raise ValueError("metric must be one of {}".format(list(distances)))
+
+    diagrams = [as_diagram(diagram) for diagram in diagrams]
+    N = len(diagrams)
+    matrix = np.zeros((N, N))
+    tasks = ((chunk, metric, options)
+             for chunk in chunked(combinations(range(N), 2), chunksize))
+
+    for results in bounded_map(_pair_distances, tasks, workers, inflight,
+                               ordered=False, setup=partial(
+                                   share, diagrams=diagrams)):
+        for i, j, distance in results:
+            matrix[i, j] = matrix[j, i] = distance
+
+    return matrix
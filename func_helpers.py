@@ -1,8 +1,19 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
 import requests
 import numpy as np
+import pandas as pd
 from heapq import merge
 from functools import partial
 from itertools import combinations, tee
+from concurrent.futures import ThreadPoolExecutor
+from cyclic_analysis import sort_lead_matrix
+from parallel_helpers import bounded_map, chunked, share
+from us_states import us_state_abbrev
 
 
 def gaussian(x, mu, b=0, k=1):
@@ -38,6 +49,56 @@ def sensed_gaussian(x, params, dist):
     return np.exp(-(x-dist-mu*k+b*randval)**2/2)
 
 
+def gaussian_pulses(x, mu, b=0, k=1, dist=0, rng=None, chunk=None,
+                    out=None):
+    """Evaluate many pulses at many sensors over a grid in one go.
+
+    Pulse p seen by sensor s is `sensed_gaussian(x, params[p], dist[s])`,
+    i.e. exp(-(x - dist[s] - mu[p]*k[p] + b[p]*randval[p])**2/2), computed
+    for all pulses, sensors and grid points with one broadcast.
+
+    Parameters
+    ----------
+    x
+        A 1-D evaluation grid
+    mu, b, k
+        Scalars or arrays (broadcast against each other) with the fundamental
+        mean, noise spread and mean offset of every pulse
+    dist
+        A scalar or array of sensor distances from the source node
+    rng
+        A `np.random.Generator` for the noise draws; a fresh one if None
+    chunk
+        Fill the result this many grid points at a time, so temporaries
+        stay small for large grids
+    out
+        Optional (pulses x sensors x len(x)) array, e.g. an `np.memmap`,
+        to write the result into
+
+    Returns
+    -------
+    A tuple (params, response) where params is the tuple of arrays
+    (mu, b, k, randval) and response has shape (pulses, sensors, len(x))
+    """
+    x = np.asarray(x, dtype=float)
+    mu, b, k = map(np.ravel, np.broadcast_arrays(mu, b, k))
+    dist = np.ravel(dist).astype(float)
+    rng = rng or np.random.default_rng()
+
+    randval = rng.random(mu.shape)
+    centres = (mu * k - b * randval)[:, np.newaxis] + dist[np.newaxis, :]
+    if out is None:
+        out = np.empty(centres.shape + x.shape)
+
+    size = chunk or max(len(x), 1)
+    for start in range(0, len(x), size):
+        grid = x[start:start + size]
+        np.exp(-(grid - centres[..., np.newaxis])**2 / 2,
+               out=out[..., start:start + size])
+
+    return (mu, b, k, randval), out
+
+
 def find_nearest(array, value):
     """Find the element in 1-D array that is closest to value.
 
@@ -53,6 +114,72 @@ def find_nearest(array, value):
     return array[idx]
 
 
+class NearestIndex:
+    """ A sorted index of a 1-D array for batched `find_nearest` lookups.
+
+    The array is sorted once (or used as is when it is already sorted) and
+    every query is then a binary search, O(log n) instead of O(n). Ties are
+    broken like `find_nearest`: among equally close elements the one that
+    comes first in the original array wins.
+
+    Parameters
+    ----------
+    array:
+        A 1-D array without NaNs to look values up in
+    """
+
+    def __init__(self, array):
+        """ Constructor for the NearestIndex class
+
+        Parameters
+        ----------
+        array:
+            A 1-D array without NaNs to look values up in
+        """
+        self.array = np.asarray(array)
+        if np.all(self.array[:-1] <= self.array[1:]):
+            self.order = np.arange(len(self.array))
+            self.sorted = self.array
+        else:
+            # A stable sort keeps equal values in their original order
+            self.order = np.argsort(self.array, kind='stable')
+            self.sorted = self.array[self.order]
+
+    def query(self, values):
+        """ Nearest elements and their indices in the original array.
+
+        Parameters
+        ----------
+        values:
+            A scalar or array of values to look up
+
+        Returns
+        -------
+        A tuple (nearest values, indices) shaped like values
+        """
+        values = np.asarray(values)
+        last = len(self.sorted) - 1
+        upper = np.searchsorted(self.sorted, values, 'left')
+        right = np.minimum(upper, last)
+        left = np.maximum(upper - 1, 0)
+        # Move to the first of a run of equal values (lowest original index)
+        left = np.searchsorted(self.sorted, self.sorted[left], 'left')
+
+        left_gap = np.abs(self.sorted[left] - values)
+        right_gap = np.abs(self.sorted[right] - values)
+        left_idx, right_idx = self.order[left], self.order[right]
+        use_right = ((right_gap < left_gap)
+                     | ((right_gap == left_gap) & (right_idx < left_idx)))
+
+        idx = np.where(use_right, right_idx, left_idx)
+        return self.array[idx], idx
+
+    def __repr__(self):
+        """ Pretty print a NearestIndex instance """
+        return "Nearest value index over {n} elements.".format(
+            n=len(self.array))
+
+
 def flatten(regular_list):
     """Flattens a list using list comprehensions.
 
@@ -64,7 +191,9 @@ def flatten(regular_list):
     return [item for sublist in regular_list for item in sublist]
 
 
-def download_file_from_google_drive(id, destination):
+def download_file_from_google_drive(id, destination, workers=None,
+                                    part_size=2**23, checksum=None,
+                                    session=None):
     """Download a drive from Google Drive give id from shareable link.
 
     Parameters
@@ -73,19 +202,272 @@ def download_file_from_google_drive(id, destination):
         The file identifier from a shareable link
     destination:
         The filename to save as on local disk
+    workers:
+        If given, fetch the file in parallel byte ranges with this many
+        connections and resume interrupted downloads (see `download_ranges`)
+    part_size:
+        Size in bytes of each range when using workers
+    checksum:
+        Optional "algorithm:hexdigest" string, e.g. "sha256:ab12...", to
+        verify the downloaded file against
+    session:
+        A requests.Session to reuse; a new one if None
     """
     URL = "https://docs.google.com/uc?export=download&confirm=9iBg"
 
-    session = requests.Session()
+    session = session or requests.Session()
 
-    response = session.get(URL, params={'id': id}, stream=True)
+    params = {'id': id}
+    response = session.get(URL, params=params, stream=True)
     token = get_confirm_token(response)
 
     if token:
         params = {'id': id, 'confirm': token}
         response = session.get(URL, params=params, stream=True)
 
+    if workers:
+        response.close()
+        download_ranges(URL, destination, params, session, workers,
+                        part_size, checksum)
+        return
+
     save_response_content(response, destination)
+    if checksum:
+        verify_checksum(destination, checksum)
+
+
+def verify_checksum(filename, checksum):
+    """Raise a ValueError unless filename hashes to checksum.
+
+    Parameters
+    ----------
+    filename:
+        The file on local disk to check
+    checksum:
+        An "algorithm:hexdigest" string; any `hashlib` algorithm works
+    """
+    algorithm, expected = checksum.split(':', 1)
+    digest = file_digest(filename, algorithm)
+    if digest != expected.lower():
+        raise ValueError("Checksum mismatch for {}: got {}:{}".format(
+            filename, algorithm, digest))
+
+
+def remote_size(session, url, params=None):
+    """Size of a remote file if the server honours Range requests, else None.
+    """
+    response = session.get(url, params=params, stream=True,
+                           headers={'Range': 'bytes=0-0'})
+    response.close()
+    content_range = response.headers.get('Content-Range', '')
+    if response.status_code != 206 or '/' not in content_range:
+        return None
+
+    size = content_range.rsplit('/', 1)[1]
+    return int(size) if size.isdigit() else None
+
+
+def download_ranges(url, destination, params=None, session=None, workers=4,
+                    part_size=2**23, checksum=None):
+    """Download a file in parallel byte ranges, resuming earlier attempts.
+
+    The destination is preallocated to the full size and every range is
+    written in place as soon as it arrives. Finished ranges are recorded in
+    a sidecar "<destination>.progress" JSON file, so running the same call
+    again after a dropped connection only fetches the missing ranges (a
+    different url, params, size or part_size starts over). The
+    sidecar is removed once the file is complete (and verified). Servers
+    that ignore Range requests get a plain single stream download.
+
+    Parameters
+    ----------
+    url:
+        The address of the file
+    destination:
+        The filename to save as on local disk
+    params:
+        Query parameters of the request
+    session:
+        A requests.Session to use; a new one if None
+    workers:
+        Number of ranges fetched at the same time
+    part_size:
+        Size in bytes of each range
+    checksum:
+        Optional "algorithm:hexdigest" string to verify the file against
+    """
+    session = session or requests.Session()
+    size = remote_size(session, url, params)
+    if size is None:
+        response = session.get(url, params=params, stream=True)
+        response.raise_for_status()
+        save_response_content(response, destination)
+        if checksum:
+            verify_checksum(destination, checksum)
+        return destination
+
+    # Only resume ranges of the same file: the JSON round trip makes the
+    # new record comparable with a saved one
+    sidecar = destination + '.progress'
+    progress = json.loads(json.dumps(
+        {'url': url, 'params': sorted((params or {}).items()), 'size': size,
+         'part_size': part_size, 'done': []}))
+    if os.path.exists(sidecar) and os.path.exists(destination):
+        with open(sidecar) as f:
+            saved = json.load(f)
+        if all(saved.get(key) == progress[key]
+               for key in ('url', 'params', 'size', 'part_size')):
+            progress = saved
+
+    if not progress['done']:
+        with open(destination, 'wb') as f:
+            f.truncate(size)
+
+    done = set(progress['done'])
+    lock = threading.Lock()
+
+    def fetch(start):
+        end = min(start + part_size, size) - 1
+        response = session.get(url, params=params,
+                               headers={'Range': 'bytes={}-{}'.format(start,
+                                                                      end)})
+        response.raise_for_status()
+        if response.status_code != 206 or len(response.content) != end - start + 1:
+            raise IOError("Bad response for bytes {}-{} of {}".format(
+                start, end, url))
+
+        with open(destination, 'r+b') as f:
+            f.seek(start)
+            f.write(response.content)
+
+        with lock:
+            done.add(start)
+            progress['done'] = sorted(done)
+            with open(sidecar + '.tmp', 'w') as f:
+                json.dump(progress, f)
+            os.replace(sidecar + '.tmp', sidecar)
+
+    missing = [start for start in range(0, size, part_size)
+               if start not in done]
+    # Let every range finish (and be recorded) before reporting a failure
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        *futures, = map(partial(pool.submit, fetch), missing)
+    for future in futures:
+        future.result()
+
+    if checksum:
+        try:
+            verify_checksum(destination, checksum)
+        except ValueError:
+            os.remove(sidecar)
+            raise
+
+    if os.path.exists(sidecar):
+        os.remove(sidecar)
+    return destination
+
+
+def file_digest(filename, algorithm='sha256'):
+    """Hex digest of a file on local disk, read in 1 MiB blocks."""
+    digest = hashlib.new(algorithm)
+    with open(filename, 'rb') as f:
+        for block in iter(partial(f.read, 2**20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def pooled_session(workers):
+    """A requests.Session whose connection pool fits `workers` threads."""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=workers,
+                                            pool_maxsize=workers)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def download_files_from_google_drive(files, workers=4, cache_dir=None,
+                                     session=None, fetch=None, **options):
+    """Download many Google Drive files concurrently.
+
+    Parameters
+    ----------
+    files:
+        An iterable of (id, destination) pairs
+    workers:
+        Number of files downloaded at the same time; they share one
+        session and hence one connection pool
+    cache_dir:
+        Optional directory of a content addressed cache. Files are stored
+        there under their sha256 and an index maps ids to digests, so an id
+        that was fetched before (by any notebook) is copied from the cache
+        instead of downloaded again.
+    session:
+        A requests.Session to share; a pooled one if None
+    fetch:
+        The function doing a single download, called as
+        fetch(id, destination, session=session, **options); defaults to
+        `download_file_from_google_drive`
+    **options:
+        Passed on to fetch, e.g. workers/checksum of the range downloader
+
+    Returns
+    -------
+    A list with one dict per file, in input order, with keys id,
+    destination, bytes, seconds, throughput (bytes/s), cached and error
+    (None, or the text of the exception that stopped that file, in which
+    case bytes and throughput are 0)
+    """
+    files = list(files)
+    session = session or pooled_session(workers)
+    fetch = fetch or download_file_from_google_drive
+    lock = threading.Lock()
+
+    index_file = None
+    index = dict()
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        index_file = os.path.join(cache_dir, 'index.json')
+        if os.path.exists(index_file):
+            with open(index_file) as f:
+                index = json.load(f)
+
+    def get(pair):
+        id, destination = pair
+        report = {'id': id, 'destination': destination, 'cached': False,
+                  'error': None}
+        start = time.perf_counter()
+        try:
+            with lock:
+                blob = index.get(id)
+            blob = blob and os.path.join(cache_dir, blob)
+            if blob and os.path.exists(blob):
+                shutil.copyfile(blob, destination)
+                report['cached'] = True
+            else:
+                fetch(id, destination, session=session, **options)
+                if cache_dir is not None:
+                    digest = file_digest(destination)
+                    shutil.copyfile(destination,
+                                    os.path.join(cache_dir, digest))
+                    with lock:
+                        index[id] = digest
+                        with open(index_file + '.tmp', 'w') as f:
+                            json.dump(index, f)
+                        os.replace(index_file + '.tmp', index_file)
+        except Exception as error:
+            report['error'] = repr(error)
+
+        report['seconds'] = time.perf_counter() - start
+        # Whatever a failed download left at destination does not count
+        report['bytes'] = (os.path.getsize(destination)
+                           if report['error'] is None
+                           and os.path.exists(destination) else 0)
+        report['throughput'] = report['bytes'] / max(report['seconds'], 1e-9)
+        return report
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(get, files))
 
 
 def get_confirm_token(response):
@@ -178,34 +560,162 @@ def prune(x, y):
     return xvals[:N], yvals[:N]
 
 
+def fast_prune(x, y):
+    """Array based version of `prune` with identical outputs.
+
+    Instead of merging tagged tuples it stably sorts the concatenated
+    timestamps (so ties keep samples of x before those of y, as `merge`
+    does) and picks the samples after which the label changes with
+    boolean masks.
+
+    Parameters
+    ----------
+    x
+        A tuple of (timestamps, data)
+    y
+        A tuple of (timestamps, data)
+    """
+    times = np.concatenate((x[0], y[0]))
+    order = np.argsort(times, kind='stable')
+    mixed_seq = np.concatenate((x[1], y[1]))[order]
+    from_x = order < len(x[0])
+
+    # A sample is kept if the next merged sample comes from the other series
+    changes = np.append(from_x[:-1] != from_x[1:], False)
+    xvals, yvals = mixed_seq[changes & from_x], mixed_seq[changes & ~from_x]
+    N = min(map(len, [xvals, yvals]))
+
+    return xvals[:N], yvals[:N]
+
+
 def make_pairs(data):
     """Make pruned pairs from a list of data."""
-    return [prune(*pair) for j, pair in enumerate(combinations(data, 2))]
+    return [fast_prune(*pair) for j, pair in enumerate(combinations(data, 2))]
+
+
+def _pair_areas(args, shared):
+    """Prune and integrate a chunk of index pairs (a pool task)."""
+    index_pairs, intfunc = args
+    data_list = shared['data_list']
+    return [(i, j, intfunc(fast_prune(data_list[i], data_list[j])))
+            for i, j in index_pairs]
+
 
+def iter_pairs(data):
+    """Lazily yield ((i, j), pruned pair) for every i < j in data."""
+    for i, j in combinations(range(len(data)), 2):
+        yield (i, j), fast_prune(data[i], data[j])
 
-def make_lead_matrix(data_list, intfunc):
+
+def make_lead_matrix(data_list, intfunc, workers=None, chunksize=256,
+                     inflight=None):
     """Manually create the lead matrix from a list & integration function.
 
+    Index pairs are produced lazily and handed out in chunks, so no list of
+    all N(N-1)/2 pruned pairs is ever built; each chunk is pruned and
+    integrated in a worker process that received the data list once.
+
     Parameters
     ----------
     data_list
         A list of tuples (timestamps, firingrates)
     intfunc
-        A function to create the area value from a pair of time series
+        A function to create the area value from a pair of time series;
+        it must be picklable (defined at module level) when using workers
+    workers
+        Number of worker processes; run serially if None
+    chunksize
+        Number of pairs per pool task
+    inflight
+        Maximum number of chunks in flight (default 2*workers)
     """
     N = len(data_list)
     lead_matrix = np.zeros((N, N))
-    upper_triangle = [(i, j) for i in range(N) for j in range(i + 1, N)]
+    tasks = ((chunk, intfunc)
+             for chunk in chunked(combinations(range(N), 2), chunksize))
 
-    for *index, pair in zip(upper_triangle, make_pairs(data_list)):
-        index = index.pop()
-        area = intfunc(pair)
-        lead_matrix[index] = area
-        lead_matrix[tuple(reversed(index))] = - area
+    for areas in bounded_map(_pair_areas, tasks, workers, inflight,
+                             ordered=False, setup=partial(
+                                 share, data_list=data_list)):
+        for i, j, area in areas:
+            lead_matrix[i, j] = area
+            lead_matrix[j, i] = - area
 
     return sort_lead_matrix(lead_matrix, 1)
 
 
+def grid_segments(times, rates, grid):
+    """Trapezoid midpoints and increments of one series on a global grid.
+
+    The series is linearly interpolated onto the grid. A grid segment only
+    counts where it lies between two consecutive non-NaN samples of the
+    series; elsewhere (before its first sample, after its last, or across a
+    NaN gap) both outputs are zero, so the gap drops out of every area.
+
+    Parameters
+    ----------
+    times, rates
+        The timestamps and (possibly NaN) values of the series
+    grid
+        Sorted grid points; the outputs have one entry per grid segment
+    """
+    times, rates = np.asarray(times, float), np.asarray(rates, float)
+    valid = ~np.isnan(rates)
+    midpoints, increments = np.zeros((2, len(grid) - 1))
+    if valid.sum() < 2:
+        return midpoints, increments
+
+    values = np.interp(grid, times[valid], rates[valid])
+    interval = np.searchsorted(times, grid[:-1], 'right') - 1
+    inside = (interval >= 0) & (interval < len(times) - 1)
+    interval = np.where(inside, interval, 0)
+    usable = (inside & valid[interval] & valid[interval + 1]
+              & (grid[1:] <= times[interval + 1]))
+
+    midpoints[usable] = ((values[:-1] + values[1:]) / 2)[usable]
+    increments[usable] = np.diff(values)[usable]
+    return midpoints, increments
+
+
+def grid_lead_matrix(data_list, chunk=4096):
+    """Create the lead matrix of irregularly sampled series in one go.
+
+    Every series is put on the merged grid of all timestamps, and the
+    signed area between series i and j is the trapezoid (Stieltjes) sum
+    sum_k xbar_i[k] dx_j[k] - xbar_j[k] dx_i[k] over the grid segments
+    where both series have data. All pairs come out of a single matrix
+    product per chunk of segments; a NaN gap in one series only removes
+    the segments it covers. For common, gap free timestamps this equals
+    `create_lead_matrix` of the (end matched) data.
+
+    Parameters
+    ----------
+    data_list
+        A list of tuples (timestamps, firingrates), e.g. from
+        `Field.get_timeseries`
+    chunk
+        Number of grid segments per matrix product; all at once if None.
+        Each chunk holds two N x chunk arrays, so memory is about
+        16 N chunk bytes whatever the length L of the merged grid (with
+        chunk=None it is 16 N L bytes, which is huge when every series has
+        its own timestamps); the time is O(N^2 L) either way.
+    """
+    *data_list, = ((np.asarray(t, float), np.asarray(r, float))
+                   for t, r in data_list)
+    N = len(data_list)
+    grid = np.unique(np.concatenate([t for t, _ in data_list]))
+    areas = np.zeros((N, N))
+
+    size = chunk or max(len(grid) - 1, 1)
+    for start in range(0, len(grid) - 1, size):
+        segment = grid[start:start + size + 1]
+        *parts, = (grid_segments(t, r, segment) for t, r in data_list)
+        midpoints, increments = map(np.asarray, zip(*parts))
+        areas += midpoints.dot(increments.T)
+
+    return sort_lead_matrix(areas - areas.T, 1)
+
+
 def pairwise(iterable):
     """Iterate over an iterable two elements at a time."""
     a, b = tee(iterable)
@@ -218,6 +728,68 @@ def moving_average(n, x):
     return np.convolve(x, np.ones(n), 'valid') / n
 
 
+class MovingAverage:
+    """ A streaming n-point moving average over one or many series.
+
+    Keeps the last n running sums of every row between calls, so pushing a
+    series in pieces gives exactly the output of pushing it in one go (and
+    of `moving_averages`): the running sums are accumulated strictly left
+    to right either way. Each output is a difference of two running sums,
+    so for very long series with a large mean some precision is lost
+    compared to `moving_average`.
+
+    Parameters
+    ----------
+    n:
+        Number of points to average
+    """
+
+    def __init__(self, n):
+        """ Constructor for the MovingAverage class
+
+        Parameters
+        ----------
+        n:
+            Number of points to average
+        """
+        self.n = n
+        self.sums = None
+
+    def push(self, chunk):
+        """ Add the next samples and return the newly completed averages.
+
+        Parameters
+        ----------
+        chunk:
+            A 1-D array, or a 2-D array with one series per row
+
+        Returns
+        -------
+        The averages of all windows ending inside chunk, shaped like chunk
+        but with (up to n-1) fewer columns
+        """
+        chunk = np.asarray(chunk, dtype=float)
+        rows = np.atleast_2d(chunk)
+        if self.sums is None:
+            self.sums = np.zeros((rows.shape[0], 1))
+
+        sums = np.cumsum(np.hstack((self.sums[:, -1:], rows)), axis=1)
+        sums = np.hstack((self.sums[:, :-1], sums))
+        averages = (sums[:, self.n:] - sums[:, :-self.n]) / self.n
+        self.sums = sums[:, -self.n:]
+
+        return averages[0] if chunk.ndim == 1 else averages
+
+
+def moving_averages(n, X):
+    """ Calculate the n-point moving average along every row of X at once.
+
+    Matches `moving_average` up to rounding, and `MovingAverage.push`
+    exactly.
+    """
+    return MovingAverage(n).push(X)
+
+
 def get_stats(state, start):
     """Plot data related to an US State.
     Parameters
@@ -242,3 +814,151 @@ def get_stats(state, start):
     
     return np.asarray(dates), daily_cases
 
+
+class StateSeries:
+    """ The series of one US State, as used by `plot_helpers.plot_state`.
+
+    Parameters
+    ----------
+    abbrev:
+        A 2 letter abbreviation (string)
+    raw, smooth, logts:
+        Tuples of (dates, data)
+    """
+
+    def __init__(self, abbrev, raw, smooth, logts):
+        """ Constructor for the StateSeries class
+
+        Parameters
+        ----------
+        abbrev:
+            A 2 letter abbreviation (string)
+        raw, smooth, logts:
+            Tuples of (dates, data)
+        """
+        self.abbrev = abbrev
+        self.raw, self.smooth, self.logts = raw, smooth, logts
+
+    def __repr__(self):
+        """ Pretty print a StateSeries instance """
+        return self.abbrev
+
+
+class StateTable:
+    """ Daily case series of every US State on a shared date axis.
+
+    Parameters
+    ----------
+    abbrevs:
+        Array of the 2 letter abbreviations, one per row
+    dates:
+        Array of datetime64 dates, one per column of raw
+    raw:
+        (states x dates) array of daily cases; 0 where a state did not report
+    n:
+        Number of days in the moving average of the smooth series
+    """
+
+    def __init__(self, abbrevs, dates, raw, n):
+        """ Constructor for the StateTable class
+
+        Parameters
+        ----------
+        abbrevs:
+            Array of the 2 letter abbreviations, one per row
+        dates:
+            Array of datetime64 dates, one per column of raw
+        raw:
+            (states x dates) array of daily cases
+        n:
+            Number of days in the moving average of the smooth series
+        """
+        self.abbrevs, self.dates, self.raw, self.n = abbrevs, dates, raw, n
+        self.smooth = moving_averages(n, raw)
+        self.logts = np.log(self.smooth, out=np.full_like(self.smooth, np.nan),
+                            where=self.smooth > 0)
+        self.rows = {abbrev: i for i, abbrev in enumerate(abbrevs)}
+
+    def __getitem__(self, abbrev):
+        """ The `StateSeries` of the state with abbreviation abbrev. """
+        i = self.rows[abbrev]
+        smooth_dates = self.dates[self.n - 1:]
+        return StateSeries(abbrev, (self.dates, self.raw[i]),
+                           (smooth_dates, self.smooth[i]),
+                           (smooth_dates, self.logts[i]))
+
+    def save(self, filename, key=''):
+        """ Store the table as a compressed `.npz` file, tagged with key. """
+        np.savez_compressed(filename, abbrevs=self.abbrevs, dates=self.dates,
+                            raw=self.raw, n=self.n, key=key)
+
+    @staticmethod
+    def stored_key(filename):
+        """ The key a table was saved with ('' if none). """
+        with np.load(filename) as stored:
+            return str(stored['key']) if 'key' in stored.files else ''
+
+    @classmethod
+    def load(cls, filename):
+        """ Read a table written by `save`. """
+        with np.load(filename) as stored:
+            return cls(stored['abbrevs'], stored['dates'], stored['raw'],
+                       int(stored['n']))
+
+    def __repr__(self):
+        """ Pretty print a StateTable instance """
+        return "Case series of {s} states over {d} days.".format(
+            s=len(self.abbrevs), d=len(self.dates))
+
+
+def stats_key(data, start, n):
+    """ Hash of the columns of data used by `get_all_stats`, with start and
+    n, so that revised daily counts invalidate a cached table. """
+    columns = data[['state', 'date', 'positiveIncrease']]
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(repr((str(start), int(n))).encode())
+    digest.update(pd.util.hash_pandas_object(columns, index=False).values)
+    return digest.hexdigest()
+
+
+def get_all_stats(data, start, n=7, cache=None):
+    """Extract the daily cases of every US State in one pass.
+
+    Does the work of calling `get_stats` once per state with a single
+    pivot of the whole dataset onto a shared (states x dates) grid, and
+    computes the raw/smooth/logts series of all states in vectorized form.
+
+    Parameters
+    ----------
+    data
+        The full dataframe with 'state', 'date' and 'positiveIncrease'
+        columns
+    start
+        The date from which to start collating data
+    n
+        Number of days in the moving average of the smooth series
+    cache
+        Optional `.npz` filename; reused when it was written for the same
+        start, n and content of data (see `stats_key`), rewritten otherwise
+
+    Returns
+    -------
+    A `StateTable`; index it with an abbreviation to get the series of one
+    state for `plot_helpers.plot_state`
+    """
+    key = stats_key(data, start, n)
+    if (cache is not None and os.path.exists(cache)
+            and StateTable.stored_key(cache) == key):
+        return StateTable.load(cache)
+
+    abbrevs = np.asarray(list(us_state_abbrev.values()))
+    table = data.pivot_table(index='state', columns='date',
+                             values='positiveIncrease', aggfunc='sum')
+    table = table.reindex(index=abbrevs).sort_index(axis=1).loc[:, start:]
+    dates = np.asarray(table.columns.values, dtype='datetime64')
+    raw = np.nan_to_num(table.to_numpy(dtype=float))
+
+    states = StateTable(abbrevs, dates, raw, n)
+    if cache is not None:
+        states.save(cache, key)
+    return states
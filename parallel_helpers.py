@@ -0,0 +1,97 @@
+from functools import partial
+from collections import deque
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+
+# What `setup` returned in this worker process (see `bounded_map`)
+_worker_data = dict()
+
+
+def share(**items):
+    """A `setup` for `bounded_map` that hands the items as is to tasks."""
+    return items
+
+
+def _setup_worker(setup, setup_args):
+    """Pool initializer: run setup once and keep its result."""
+    _worker_data['data'] = setup(*setup_args)
+
+
+def _call_with_data(func, item):
+    """Call func on an item and the data of this worker."""
+    return func(item, _worker_data['data'])
+
+
+def chunked(iterable, size):
+    """Yield successive lists of at most `size` items from an iterable."""
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, size))
+
+
+def bounded_map(func, iterable, workers=None, inflight=None, ordered=True,
+                setup=None, setup_args=()):
+    """Lazily map func over an iterable on a process pool.
+
+    At most `inflight` tasks are submitted at any time, so neither the
+    inputs nor the results pile up in memory when the iterable is a long
+    generator.
+
+    Parameters
+    ----------
+    func
+        A picklable (module level) function of one argument, or of two,
+        func(item, data), when `setup` is given
+    iterable
+        The arguments to map over, consumed lazily
+    workers
+        Number of worker processes. None, 0 or 1 runs everything in this
+        process without a pool.
+    inflight
+        Maximum number of submitted but unconsumed tasks (default 2*workers)
+    ordered
+        Yield results in input order; otherwise yield them as they finish
+    setup, setup_args
+        A picklable function run once per process (in every worker, or
+        here when running serially) whose result is passed to every call
+        of func, e.g. `share` to hand large data to the workers a single
+        time. Nothing is stored in this process, so concurrent or nested
+        serial maps cannot see each other's data.
+    """
+    if not workers or workers == 1:
+        if setup is None:
+            yield from map(func, iterable)
+        else:
+            data = setup(*setup_args)
+            yield from (func(item, data) for item in iterable)
+        return
+
+    inflight = inflight or 2 * workers
+    iterator = iter(iterable)
+
+    initializer, initargs = None, ()
+    if setup is not None:
+        func = partial(_call_with_data, func)
+        initializer, initargs = _setup_worker, (setup, setup_args)
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=initializer,
+                             initargs=initargs) as pool:
+        pending = deque(pool.submit(func, item)
+                        for item in islice(iterator, inflight))
+        while pending:
+            if ordered:
+                done = [pending.popleft()]
+            else:
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                done = [future for future in pending if future in finished]
+                for future in done:
+                    pending.remove(future)
+
+            for future in done:
+                result = future.result()
+                for item in islice(iterator, 1):
+                    pending.append(pool.submit(func, item))
+                yield result
@@ -38,6 +38,66 @@ def ou_process(mu, sigma, theta, T, N, x0=None):
     return t, x
 
 
+def ou_paths(mu, sigma, theta, T, N, M=None, x0=None, rng=None):
+    """Simulate many Ornstein-Uhlenbeck paths at once.
+
+    Unlike ou_process, which takes Euler-Maruyama steps, this samples the
+    exact transition: over a step dt the deviation from mu shrinks by
+    a = exp(-theta*dt) and gains Gaussian noise of variance
+    sigma**2 (1 - a**2) / (2 theta). That AR(1) recursion is run along all
+    paths at once by a log-depth scan.
+
+    Parameters
+    ----------
+    mu, sigma, theta
+        The usual suspects, scalars or one value per path
+    T
+        The time to simulate until
+    N
+        The number of steps to take.
+    M
+        The number of paths (default: the length of the per-path arguments)
+    x0
+        Initial conditions optional, standard normal by default
+    rng
+        A np.random.Generator (default: a freshly seeded one)
+
+    Returns
+    -------
+    The time points (N,) and the paths (M x N)
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    if M is None:
+        M = np.broadcast(*[np.atleast_1d(v) for v in (mu, sigma, theta)
+                           + (() if x0 is None else (x0,))]).size
+    mu, sigma, theta = [np.broadcast_to(np.asarray(v, dtype=float), (M,))
+                        for v in (mu, sigma, theta)]
+    if x0 is None:
+        x0 = rng.normal(loc=0.0, scale=1.0, size=M)
+    x0 = np.broadcast_to(np.asarray(x0, dtype=float), (M,))
+
+    t = np.linspace(0, T, N)
+    dt = T / (N - 1) if N > 1 else 0.0
+
+    # Stationary-variance factor, tending to dt as theta goes to 0
+    a = np.exp(-theta * dt)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scale = np.where(theta != 0,
+                         -np.expm1(-2 * theta * dt) / (2 * theta), dt)
+    x = rng.normal(size=(M, N)) * (sigma * np.sqrt(scale))[:, None]
+    x[:, 0] = x0 - mu
+
+    # Run x[i] = a x[i-1] + noise[i] along every row by doubling: after the
+    # step with shift s each sample holds the last 2s terms of its sum
+    power, shift = a[:, None], 1
+    while shift < N:
+        x[:, shift:] += power * x[:, :-shift].copy()
+        power, shift = power * power, 2 * shift
+    x += mu[:, None]
+
+    return t, x
+
+
 def gbm(mu, sigma, T, N, x0=None):
     """ Simulate the Geometric Brownian Motion 
 
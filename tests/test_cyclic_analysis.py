@@ -0,0 +1,118 @@
+import os
+import tracemalloc
+
+import numpy as np
+import pytest
+
+import cyclic_analysis as ca
+
+
+def random_walks(N=12, T=500, seed=0):
+    return np.random.default_rng(seed).normal(size=(N, T)).cumsum(axis=1)
+
+
+def peak_memory(func):
+    """ Peak traced memory of one call of func. """
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+@pytest.mark.parametrize('trend', list(ca.trend_removals))
+@pytest.mark.parametrize('norm', list(ca.norms))
+def test_preprocessor_matches_chain(trend, norm):
+    Z = random_walks()
+    expected = ca.match_ends(ca.trend_removals[trend][1](Z) if trend else Z)
+    expected = ca.norms[norm][1](expected) if norm else expected
+    result = ca.Preprocessor(trend, norm, chunk=77)(Z)
+    np.testing.assert_allclose(result, expected, atol=1e-12)
+
+
+def test_preprocessor_peak_memory_below_chain():
+    Z = random_walks(100, 20000)
+    chained = peak_memory(
+        lambda: ca.tv_norm(ca.match_ends(ca.remove_linear(Z))))
+    fused = peak_memory(lambda: ca.Preprocessor('linear', 'tv')(Z))
+    out = np.empty_like(Z)
+    into_out = peak_memory(
+        lambda: ca.Preprocessor('linear', 'tv')(Z, out=out))
+    assert fused < chained
+    assert fused < 2 * Z.nbytes
+    assert into_out < Z.nbytes
+
+
+def test_preprocessor_rejects_integer_output():
+    Z = np.arange(40).reshape(4, 10)
+    with pytest.raises(ValueError):
+        ca.Preprocessor(None, 'sqr')(Z, inplace=True)
+
+
+def test_gemm_engine_matches_loop():
+    Z = ca.match_ends(random_walks(9, 300))
+    np.testing.assert_allclose(ca.create_lead_matrix(Z, 'gemm'),
+                               ca.create_lead_matrix(Z, 'loop'),
+                               atol=1e-9 * np.abs(Z).max()**2)
+
+
+def reference_lead_matrix(Z):
+    return ca.create_lead_matrix(ca.match_ends(Z))
+
+
+@pytest.mark.parametrize('sizes', [[1] * 40, [3, 1, 17, 2, 11, 6],
+                                   [40], [0, 39, 0, 1]])
+def test_accumulator_matches_create_lead_matrix(sizes):
+    Z = random_walks(7, sum(sizes))
+    accumulator = ca.LeadMatrixAccumulator(7)
+    for part in np.split(Z, np.cumsum(sizes)[:-1], axis=1):
+        accumulator.update(part)
+    expected = reference_lead_matrix(Z)
+    np.testing.assert_allclose(accumulator.finalize(), expected,
+                               atol=1e-12 * np.abs(expected).max())
+
+
+def test_streamed_lead_matrix_from_chunks():
+    Z = random_walks(5, 101)
+    expected = reference_lead_matrix(Z)
+    for size in (1, 7, 101, 500):
+        result = ca.streamed_lead_matrix(ca.iter_chunks(Z, size))
+        np.testing.assert_allclose(result, expected,
+                                   atol=1e-12 * np.abs(expected).max())
+
+
+@pytest.mark.parametrize('window, stride', [(20, 1), (20, 7), (20, 20),
+                                            (20, 33), (2, 1)])
+@pytest.mark.parametrize('refresh', [None, 3])
+def test_rolling_lead_matrices_match_windows(window, stride, refresh):
+    Z = random_walks(6, 150)
+    rolling = ca.rolling_lead_matrices(Z, window, stride, refresh=refresh)
+    starts = range(0, Z.shape[1] - window + 1, stride)
+    assert len(rolling) == len(starts)
+    for LM, start in zip(rolling, starts):
+        expected = reference_lead_matrix(Z[:, start:start + window])
+        np.testing.assert_allclose(LM, expected,
+                                   atol=1e-10 * np.abs(Z).max()**2)
+
+
+def test_result_cache_drops_corrupt_entries_and_parts(tmp_path):
+    cache = ca.ResultCache(str(tmp_path))
+    Z = random_walks(4, 50)
+    ca.cached_cyclic_analysis(Z, 1, cache)
+    [(_, _, path)] = cache.entries()
+    key = os.path.basename(path)[:-len('.npz')]
+
+    with open(path, 'r+b') as f:
+        f.truncate(os.path.getsize(path) // 2)
+    assert cache.get(key) is None and not os.path.exists(path)
+
+    part = tmp_path / 'stale.npz.part'
+    part.write_bytes(b'partial')
+    os.utime(part, (0, 0))
+    cache.evict()
+    assert not part.exists()
+
+    part.write_bytes(b'partial')
+    cache.clear()
+    assert not part.exists() and not cache.entries()
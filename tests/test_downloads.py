@@ -0,0 +1,124 @@
+import os
+import re
+import hashlib
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+import requests
+
+import func_helpers as fh
+
+SIZE = 100003
+PAYLOADS = {'/a': os.urandom(SIZE), '/b': os.urandom(SIZE)}
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """ Serves PAYLOADS, honouring single Range requests unless told not to
+    and failing the next `failures` range requests that do not start at 0. """
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        payload = PAYLOADS[self.path.split('?')[0]]
+        match = re.match(r'bytes=(\d+)-(\d+)', self.headers.get('Range', ''))
+        if match and server.ranges:
+            start, end = map(int, match.groups())
+            if start > 0:
+                with server.lock:
+                    server.requests.append(start)
+                    fail = server.failures > 0
+                    server.failures -= fail
+                if fail:
+                    self.send_response(500)
+                    self.end_headers()
+                    return
+            body = payload[start:end + 1]
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(
+                start, start + len(body) - 1, len(payload)))
+        else:
+            body = payload
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), RangeHandler)
+    server.ranges, server.failures = True, 0
+    server.requests, server.lock = [], threading.Lock()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def url(server, path):
+    return 'http://127.0.0.1:{}{}'.format(server.server_port, path)
+
+
+def read(filename):
+    with open(filename, 'rb') as f:
+        return f.read()
+
+
+def test_parallel_ranges_with_checksum(server, tmp_path):
+    destination = str(tmp_path / 'a.bin')
+    checksum = 'sha256:' + hashlib.sha256(PAYLOADS['/a']).hexdigest()
+    fh.download_ranges(url(server, '/a'), destination, workers=4,
+                       part_size=8192, checksum=checksum)
+    assert read(destination) == PAYLOADS['/a']
+    assert not os.path.exists(destination + '.progress')
+
+
+def test_resume_only_fetches_missing_ranges(server, tmp_path):
+    destination = str(tmp_path / 'a.bin')
+    server.failures = 3
+    with pytest.raises(requests.HTTPError):
+        fh.download_ranges(url(server, '/a'), destination, workers=4,
+                           part_size=8192)
+    assert os.path.exists(destination + '.progress')
+
+    server.requests.clear()
+    fh.download_ranges(url(server, '/a'), destination, workers=4,
+                       part_size=8192)
+    assert read(destination) == PAYLOADS['/a']
+    # Only the three failed ranges (none of them at 0) were fetched again
+    assert len(server.requests) == 3
+
+
+def test_other_source_does_not_resume(server, tmp_path):
+    destination = str(tmp_path / 'file.bin')
+    server.failures = 3
+    with pytest.raises(requests.HTTPError):
+        fh.download_ranges(url(server, '/a'), destination, part_size=8192)
+
+    fh.download_ranges(url(server, '/b'), destination, part_size=8192)
+    assert read(destination) == PAYLOADS['/b']
+
+
+def test_server_without_ranges(server, tmp_path):
+    destination = str(tmp_path / 'a.bin')
+    server.ranges = False
+    fh.download_ranges(url(server, '/a'), destination, part_size=8192)
+    assert read(destination) == PAYLOADS['/a']
+
+
+def test_failed_file_reports_no_bytes(tmp_path):
+    def fetch(id, destination, session=None):
+        with open(destination, 'wb') as f:
+            f.write(b'partial')
+        if id == 'bad':
+            raise IOError("connection dropped")
+
+    files = [(id, str(tmp_path / id)) for id in ('good', 'bad')]
+    good, bad = fh.download_files_from_google_drive(files, fetch=fetch,
+                                                    session=requests.Session())
+    assert good['error'] is None and good['bytes'] == 7
+    assert bad['error'] and bad['bytes'] == 0 and bad['throughput'] == 0
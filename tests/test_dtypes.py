@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+import cyclic_analysis as ca
+
+
+def cyclic_data(N=24, T=2000, seed=0):
+    """ Noisy sines with well separated phases, as float32 values. """
+    rng = np.random.default_rng(seed)
+    t = np.linspace(0, 8 * np.pi, T)
+    phases = rng.permutation(N) * 2 * np.pi / N
+    data = np.sin(t[np.newaxis] - phases[:, np.newaxis])
+    data += 0.05 * rng.normal(size=(N, T))
+    return data.astype(np.float32)
+
+
+@pytest.fixture
+def data32():
+    return cyclic_data()
+
+
+def test_lead_matrix_stays_float32(data32):
+    matched = ca.match_ends(data32, np.float32)
+    assert matched.dtype == np.float32
+    for key, (_, func) in ca.norms.items():
+        if key is not None:
+            assert func(matched, dtype=np.float32).dtype == np.float32
+    for engine in ca.lead_engines:
+        LM = ca.create_lead_matrix(matched, engine, dtype=np.float32)
+        assert LM.dtype == np.float32
+
+
+@pytest.mark.parametrize('solver', ['eig', 'eigh', 'arpack'])
+def test_eigen_sorting_stays_complex64(data32, solver):
+    LM, phases, perm, sortedLM, evals = ca.cyclic_analysis(
+        data32, 1, solver, dtype=np.float32)
+    assert LM.dtype == sortedLM.dtype == np.float32
+    assert phases.dtype == evals.dtype == np.complex64
+
+
+def test_preserve_keeps_input_dtype(data32):
+    old = ca.default_dtype
+    try:
+        ca.set_default_dtype('preserve')
+        assert ca.create_lead_matrix(ca.match_ends(data32)).dtype == np.float32
+        assert ca.create_lead_matrix(np.arange(6.).reshape(2, 3)).dtype == float
+    finally:
+        ca.set_default_dtype(old)
+
+
+def test_lead_matrix_error_within_documented_bound(data32):
+    T = data32.shape[1]
+    LM32 = ca.create_lead_matrix(ca.match_ends(data32, np.float32),
+                                 dtype=np.float32)
+    LM64 = ca.create_lead_matrix(ca.match_ends(data32, np.float64),
+                                 dtype=np.float64)
+    error = np.abs(LM32 - LM64).max() / np.abs(LM64).max()
+    # Worst case bound from the set_default_dtype docstring
+    assert error <= T * 6e-8
+
+
+@pytest.mark.parametrize('solver', ['eig', 'eigh', 'arpack'])
+def test_permutation_matches_float64(data32, solver):
+    perm32 = ca.cyclic_analysis(data32, 1, solver, dtype=np.float32)[2]
+    perm64 = ca.cyclic_analysis(data32, 1, solver, dtype=np.float64)[2]
+    np.testing.assert_array_equal(perm32, perm64)
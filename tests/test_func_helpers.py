@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+import func_helpers as fh
+
+
+def timed_series(rng, size, repeats):
+    """ Sorted timestamps (with repeats if asked) and random values. """
+    if repeats:
+        times = np.sort(rng.integers(0, size, size)).astype(float)
+    else:
+        times = np.sort(rng.uniform(0, size, size))
+    return times, rng.normal(size=size)
+
+
+@pytest.mark.parametrize('repeats', [False, True])
+def test_fast_prune_matches_prune(repeats):
+    rng = np.random.default_rng(0)
+    for _ in range(300):
+        x = timed_series(rng, rng.integers(1, 40), repeats)
+        y = timed_series(rng, rng.integers(1, 40), repeats)
+        for got, expected in zip(fh.fast_prune(x, y), fh.prune(x, y)):
+            np.testing.assert_array_equal(got, expected)
+
+
+def test_nearest_index_matches_find_nearest():
+    rng = np.random.default_rng(1)
+    for _ in range(200):
+        # Few distinct integers make equal elements and equidistant ties
+        array = rng.integers(-10, 10, rng.integers(1, 30)).astype(float)
+        if rng.random() < 0.5:
+            array.sort()
+        values = rng.integers(-12, 12, 20) + rng.choice([0, 0.5], 20)
+        nearest, idx = fh.NearestIndex(array).query(values)
+        expected = [fh.find_nearest(array, value) for value in values]
+        expected_idx = [np.abs(array - value).argmin() for value in values]
+        np.testing.assert_array_equal(nearest, expected)
+        np.testing.assert_array_equal(idx, expected_idx)
+
+
+def test_moving_average_push_in_pieces():
+    rng = np.random.default_rng(2)
+    for _ in range(100):
+        # np.convolve swaps its inputs when T < n, so keep T >= n
+        n = rng.integers(1, 8)
+        T = rng.integers(n, 60)
+        X = rng.normal(size=(3, T))
+        splits = np.sort(rng.integers(0, T + 1, rng.integers(0, 6)))
+        streaming = fh.MovingAverage(n)
+        pieces = [streaming.push(part) for part in np.split(X, splits, axis=1)]
+        result = np.concatenate(pieces, axis=1)
+
+        np.testing.assert_array_equal(result, fh.moving_averages(n, X))
+        for row, expected in zip(result, X):
+            np.testing.assert_allclose(row, fh.moving_average(n, expected),
+                                       atol=1e-12)
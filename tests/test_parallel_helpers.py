@@ -0,0 +1,23 @@
+from functools import partial
+
+from parallel_helpers import bounded_map, share
+
+
+def scaled(item, data):
+    return item * data['factor']
+
+
+def nested(item, data):
+    inner = bounded_map(scaled, range(3), setup=partial(share, factor=item))
+    return data['factor'] * sum(inner)
+
+
+def test_nested_serial_maps_keep_their_own_data():
+    results = bounded_map(nested, [1, 2], setup=partial(share, factor=10))
+    assert list(results) == [30, 60]
+
+
+def test_pool_map_hands_setup_data_to_workers():
+    results = bounded_map(scaled, range(6), workers=2,
+                          setup=partial(share, factor=3))
+    assert list(results) == [0, 3, 6, 9, 12, 15]
@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+import abr_funcs as af
+
+
+def random_series(kind, rng):
+    """ A continuous series or a tie-heavy integer one. """
+    n = rng.integers(2, 120)
+    if kind == 'continuous':
+        return rng.normal(size=n)
+    return rng.integers(0, 4, size=n).astype(float)
+
+
+def as_rows(bars):
+    """ Bars as a float array, nan-comparable whatever their container. """
+    return np.array([tuple(bar) for bar in bars], dtype=float)
+
+
+@pytest.mark.parametrize('kind', ['continuous', 'integer'])
+def test_fm_bars_matches_fm(kind):
+    rng = np.random.default_rng(0)
+    for _ in range(300):
+        series = random_series(kind, rng)
+        np.testing.assert_array_equal(as_rows(af.fm_bars(series)),
+                                      as_rows(af.fm(series)))
+
+
+def sorted_bars(bars):
+    """ Bars without the recorded column, in order of their minima. """
+    rows = as_rows(bars)[:, :4]
+    return rows[np.lexsort(rows.T[::-1])]
+
+
+@pytest.mark.parametrize('kind', ['continuous', 'integer'])
+def test_windowed_persistence_matches_fm(kind):
+    rng = np.random.default_rng(1)
+    for _ in range(100):
+        series = random_series(kind, rng)
+        windowed = af.WindowedPersistence(series)
+        window = rng.integers(1, len(series) + 1)
+        for start, bars in windowed.windows(window, rng.integers(1, 4)):
+            expected = af.fm(series[start:start + window])
+            np.testing.assert_array_equal(sorted_bars(bars),
+                                          sorted_bars(expected))
+
+
+def test_windowed_summaries():
+    series = np.random.default_rng(2).normal(size=300)
+    summaries = af.WindowedPersistence(series).summaries(50, 25, n=3)
+    assert len(summaries) == 11
+    for row in summaries:
+        bars = af.fm_bars(series[row['start']:row['start'] + 50])
+        life = bars['max_value'] - bars['min_value']
+        life = np.sort(life[~np.isnan(life)])[::-1]
+        assert row['count'] == len(life)
+        assert np.isclose(row['total'], life.sum())
+        np.testing.assert_allclose(row['top'], life[:3])
+
+
+@pytest.mark.parametrize('kind', ['continuous', 'integer'])
+def test_incremental_summaries_match_bars(kind):
+    rng = np.random.default_rng(3)
+    for _ in range(100):
+        series = random_series(kind, rng)
+        windowed = af.WindowedPersistence(series)
+        window = rng.integers(1, len(series) + 1)
+        stride = rng.integers(1, 2 * window + 2)
+        summaries = windowed.summaries(window, stride, n=3)
+        windows = list(windowed.windows(window, stride))
+        assert len(summaries) == len(windows)
+        for row, (start, bars) in zip(summaries, windows):
+            life = bars['max_value'] - bars['min_value']
+            life = np.sort(life[~np.isnan(life)])[::-1]
+            assert row['start'] == start and row['count'] == len(life)
+            assert np.isclose(row['total'], life.sum())
+            np.testing.assert_allclose(row['top'][:len(life)], life[:3])
+            assert np.isnan(row['top'][len(life):]).all()